@@ -0,0 +1,119 @@
+"""Compare memory per conversation turn: (role, text) tuple lists vs. ThreadHistory.
+
+Builds threads shaped like bot traffic (short user questions, long model
+answers) out of real prose: docstring paragraphs from the standard library,
+which compress about as well as technical answers do. Text made from a small
+vocabulary compresses far better and would overstate the packing gain.
+Measures the allocated bytes with tracemalloc for three layouts:
+  - baseline: list of (role, text) tuples (the old layout)
+  - live:     ThreadHistory with Turn records
+  - packed:   ThreadHistory after compressing idle threads
+
+Usage:
+    python playground/bench_history_memory.py [threads] [turns_per_thread]
+"""
+import importlib
+import inspect
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "slack", "src"))
+
+from turns import ThreadHistory, zstandard  # noqa: E402
+
+CORPUS_MODULES = (
+    "argparse", "asyncio", "collections", "concurrent.futures", "csv", "datetime", "email", "functools",
+    "http.client", "http.server", "json", "logging", "multiprocessing", "os", "pathlib", "pickle", "re",
+    "shutil", "socket", "sqlite3", "ssl", "subprocess", "tarfile", "threading", "typing", "unittest",
+    "urllib.request", "zipfile",
+)
+
+
+def load_paragraphs():
+    """Docstring paragraphs (30+ words) from CORPUS_MODULES and their public members."""
+    paragraphs = []
+    seen = set()
+    for name in CORPUS_MODULES:
+        try:
+            module = importlib.import_module(name)
+        except ImportError:
+            continue
+        objects = [module] + [getattr(module, attr) for attr in dir(module) if not attr.startswith("_")]
+        for obj in objects:
+            doc = inspect.getdoc(obj) if callable(obj) or inspect.ismodule(obj) else None
+            for para in (doc or "").split("\n\n"):
+                para = " ".join(para.split())
+                if len(para.split()) >= 30 and para not in seen:
+                    seen.add(para)
+                    paragraphs.append(para)
+    return paragraphs
+
+
+def make_threads(count: int, turns: int, seed: int = 7):
+    rng = random.Random(seed)
+    paragraphs = load_paragraphs()
+    threads = []
+    for _ in range(count):
+        thread = []
+        # Draw without replacement within a thread; repeated paragraphs would compress for free
+        pool = rng.sample(paragraphs, len(paragraphs))
+        for i in range(turns):
+            if i % 2 == 0:
+                # A question-sized slice of one paragraph
+                words = pool.pop().split()
+                start = rng.randrange(max(1, len(words) - 40))
+                thread.append(("user", " ".join(words[start:start + rng.randint(8, 40)]) + "?"))
+            else:
+                # An answer of a few paragraphs, some as bullets
+                parts = [pool.pop() for _ in range(rng.randint(2, 5))]
+                thread.append(("model", "\n\n".join(("- " if rng.random() < 0.3 else "") + p for p in parts)))
+        threads.append(thread)
+    return threads
+
+
+def measure(build):
+    """Return build()'s result and the net traced bytes it added (tracemalloc must be running)."""
+    before = tracemalloc.get_traced_memory()[0]
+    obj = build()
+    after = tracemalloc.get_traced_memory()[0]
+    return obj, after - before
+
+
+def main():
+    n_threads = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    n_turns = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    total_turns = n_threads * n_turns
+    # Generate source data outside the measured region; copy strings so each layout owns its text
+    source = make_threads(n_threads, n_turns)
+    # One tracing session for everything, so memory freed by packing is counted
+    tracemalloc.start()
+
+    _baseline, baseline_bytes = measure(
+        lambda: {str(i): [(str(role), "".join(list(text))) for role, text in t] for i, t in enumerate(source)}
+    )
+    live, live_bytes = measure(
+        lambda: {str(i): ThreadHistory([(role, "".join(list(text))) for role, text in t]) for i, t in enumerate(source)}
+    )
+
+    def pack_all():
+        for history in live.values():
+            history.pack()
+        return live
+
+    # Packing frees the live turns, so measure the net change plus the live size
+    _packed, delta = measure(pack_all)
+    packed_bytes = live_bytes + delta
+    tracemalloc.stop()
+
+    codec = "zstd" if zstandard is not None else "zlib"
+    print(f"{n_threads} threads x {n_turns} turns = {total_turns} turns, {len(load_paragraphs())} source paragraphs")
+    print(f"baseline (tuples):        {baseline_bytes / total_turns:10.1f} bytes/turn")
+    print(f"ThreadHistory (live):     {live_bytes / total_turns:10.1f} bytes/turn")
+    print(f"ThreadHistory ({codec}):   {packed_bytes / total_turns:10.1f} bytes/turn")
+    print(f"reduction (packed vs baseline): {baseline_bytes / max(packed_bytes, 1):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""In-memory cache of answers to first-turn questions.
+
+Entries are keyed like single-flight calls (normalized question, model,
+corpora) and tagged with the corpus version they were generated against. A
+lookup with a different version is a miss. Each entry records whether it came
+from live traffic or from cache warming (see warm.py), so hits on warmed
+entries are counted separately.
+"""
+import collections
+import threading
+import time
+from typing import Callable, Dict, Hashable, Optional
+
+
+class AnswerEntry:
+    __slots__ = ("answer", "version", "source", "created_at", "hits")
+
+    def __init__(self, answer: str, version: str, source: str, created_at: float):
+        self.answer = answer
+        self.version = version
+        self.source = source
+        self.created_at = created_at
+        self.hits = 0
+
+
+class AnswerCache:
+    def __init__(self, ttl_seconds: float = 3600.0, max_entries: int = 2000, clock: Callable[[], float] = time.time):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries: "collections.OrderedDict[Hashable, AnswerEntry]" = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {"hits": 0, "warm_hits": 0, "misses": 0, "stale": 0, "stored": 0, "warmed": 0}
+
+    def get(self, key: Hashable, version: str = "") -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            if entry.version != version or self._clock() - entry.created_at > self.ttl_seconds:
+                del self._entries[key]
+                self.stats["stale"] += 1
+                self.stats["misses"] += 1
+                return None
+            entry.hits += 1
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            if entry.source == "warm":
+                self.stats["warm_hits"] += 1
+            return entry.answer
+
+    def contains(self, key: Hashable, version: str = "") -> bool:
+        """Whether a fresh entry exists, without counting a hit or miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return (
+                entry is not None
+                and entry.version == version
+                and self._clock() - entry.created_at <= self.ttl_seconds
+            )
+
+    def put(self, key: Hashable, answer: str, version: str = "", source: str = "live") -> None:
+        with self._lock:
+            self._entries[key] = AnswerEntry(answer, version, source, self._clock())
+            self._entries.move_to_end(key)
+            self.stats["stored"] += 1
+            if source == "warm":
+                self.stats["warmed"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            warm_entries = sum(1 for e in self._entries.values() if e.source == "warm")
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                "entries": len(self._entries),
+                "warm_entries": warm_entries,
+                "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else 0.0,
+                **self.stats,
+            }
@@ -1,12 +1,34 @@
+import atexit
+import collections
+import hmac
+import json
+import math
 import os
-from typing import Dict, List, Tuple
+import signal
+import sys
+import threading
+import time
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 from dotenv import load_dotenv
 from slack_bolt import App as SlackApp
-from slack_bolt.adapter.flask import SlackRequestHandler
+from slack_bolt.adapter.flask.handler import to_flask_response
+from slack_bolt.request import BoltRequest
+from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
+from slack_sdk.signature import SignatureVerifier
+
+import profiling
+from answer_cache import AnswerCache
+from context_cache import ContextCacheManager
+from region_router import RegionRouter, corpora_in_config
+from routing import Route, RouteTable
+from single_flight import SingleFlight
+from traffic_capture import TrafficCapture
+from turns import ThreadHistory, pack_idle
+from warm import WarmJob, load_questions
 
 try:
     from google import genai
@@ -18,7 +40,10 @@ except Exception:
 
 load_dotenv()
 
-required_env = ["SLACK_SIGNING_SECRET", "SLACK_BOT_TOKEN"]
+# "http" serves /slack/events; "socket" connects over Socket Mode (see socket_mode.py)
+SLACK_MODE = os.getenv("SLACK_MODE", "http").strip().lower()
+
+required_env = ["SLACK_APP_TOKEN", "SLACK_BOT_TOKEN"] if SLACK_MODE == "socket" else ["SLACK_SIGNING_SECRET", "SLACK_BOT_TOKEN"]
 missing = [k for k in required_env if not os.environ.get(k)]
 if missing:
   raise SystemExit(f"Missing required environment variables: {', '.join(missing)}")
@@ -28,20 +53,77 @@ PORT = int(os.environ.get("PORT", "3000"))
 # Vertex AI RAG configuration
 PROJECT_ID = os.getenv("PROJECT_ID", "appier-airis-tstc")
 LOCATION = os.getenv("LOCATION", "asia-east1")
+# Regions to route generation across, best first on ties (defaults to LOCATION only)
+LOCATIONS = [l.strip() for l in os.getenv("LOCATIONS", LOCATION).split(",") if l.strip()]
 MODEL_NAME = os.getenv("MODEL_NAME", "gemini-2.5-flash")
 RAG_CORPUS_NAME = os.getenv(
     "RAG_CORPUS_NAME",
     "projects/appier-airis-tstc/locations/asia-east1/ragCorpora/4611686018427387904",
 ).strip()
+# Regions whose models may query RAG_CORPUS_NAME (empty = every region in LOCATIONS)
+RAG_MODEL_LOCATIONS = [l.strip() for l in os.getenv("RAG_MODEL_LOCATIONS", "").split(",") if l.strip()]
+
+# Opt-in raw traffic capture for replay (see replay.py); empty path disables it
+SLACK_CAPTURE_PATH = os.getenv("SLACK_CAPTURE_PATH", "").strip()
+SLACK_CAPTURE_MAX_BYTES = int(os.getenv("SLACK_CAPTURE_MAX_BYTES", str(50 * 1024 * 1024)))
+SLACK_CAPTURE_BACKUPS = int(os.getenv("SLACK_CAPTURE_BACKUPS", "5"))
+
+# Admin profiling endpoints (/admin/*) are only registered when this token is set
+ADMIN_PROFILING_TOKEN = os.getenv("ADMIN_PROFILING_TOKEN", "").strip()
+PROFILING_ENABLED = bool(ADMIN_PROFILING_TOKEN)
 
 # Slack Bolt app
 slack_app = SlackApp(
-  token=os.getenv("SLACK_BOT_TOKEN", ""),
-  signing_secret=os.getenv("SLACK_SIGNING_SECRET", "")
+  client=WebClient(
+    token=os.getenv("SLACK_BOT_TOKEN", ""),
+    base_url=os.getenv("SLACK_API_URL", WebClient.BASE_URL),
+  ),
+  signing_secret=os.getenv("SLACK_SIGNING_SECRET", ""),
+  # Signatures are checked once in slack_events() before dispatch
+  request_verification_enabled=False,
+  # Socket Mode acks envelopes itself, so listeners run inline on its bounded worker pool
+  process_before_response=SLACK_MODE == "socket",
 )
 
-# Store conversation history per thread (key: thread_ts, value: list of (role, text) tuples)
-conversation_history: Dict[str, List[Tuple[str, str]]] = {}
+# Store conversation history per thread (key: thread_ts, value: (role, text) turns, see turns.py)
+conversation_history: Dict[str, ThreadHistory] = {}
+# Threads idle this long are compressed in memory; they unpack transparently on next access
+HISTORY_PACK_IDLE_SECONDS = float(os.getenv("HISTORY_PACK_IDLE_SECONDS", "600"))
+# The sweep runs on a background thread this often, never on a request
+HISTORY_PACK_SWEEP_SECONDS = 60.0
+
+# Generation calls currently running, by thread ident (only tracked when PROFILING_ENABLED)
+_inflight_generations: Dict[int, dict] = {}
+
+# Prompt budget for thread history, in characters (~4 chars per token)
+HISTORY_CHAR_BUDGET = int(os.getenv("HISTORY_CHAR_BUDGET", "32000"))
+# Most turns kept when rehydrating a thread from Slack (the newest ones win)
+HISTORY_FETCH_LIMIT = int(os.getenv("HISTORY_FETCH_LIMIT", "200"))
+
+# Explicit Vertex context caching of long thread prefixes (opt-in: cache storage is billed)
+CONTEXT_CACHE_ENABLED = os.getenv("CONTEXT_CACHE_ENABLED", "false").lower() not in ("0", "false", "no")
+CONTEXT_CACHE_MIN_CHARS = int(os.getenv("CONTEXT_CACHE_MIN_CHARS", "16000"))
+CONTEXT_CACHE_TTL_SECONDS = int(os.getenv("CONTEXT_CACHE_TTL_SECONDS", "3600"))
+
+# Share one generation between identical first-turn questions that arrive concurrently
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() not in ("0", "false", "no")
+
+# Cache of answers to first-turn questions, tagged with the corpus version they were generated on.
+# Opt-in, and only used for routes with a corpus version (CORPUS_VERSION or the route's
+# corpus_version): without one, a corpus update could not invalidate cached answers.
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "false").lower() not in ("0", "false", "no")
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2000"))
+CORPUS_VERSION = os.getenv("CORPUS_VERSION", "").strip()
+# POST/GET /admin/warm are only registered when this token is set (separate from profiling)
+WARM_ADMIN_TOKEN = os.getenv("WARM_ADMIN_TOKEN", "").strip()
+# Questions to pre-answer in the background at startup (see warm.py)
+WARM_QUESTIONS_FILE = os.getenv("WARM_QUESTIONS_FILE", "").strip()
+WARM_CONCURRENCY = int(os.getenv("WARM_CONCURRENCY", "4"))
+
+# Per-channel / per-workspace corpus, model and generation routing (see routing.py)
+ROUTES_FILE = os.getenv("ROUTES_FILE", "").strip()
+ROUTES_RELOAD_SECONDS = float(os.getenv("ROUTES_RELOAD_SECONDS", "10"))
 
 
 def _init_rag_client():
@@ -65,9 +147,34 @@ def _init_rag_client():
 _rag_client = _init_rag_client()
 
 
-def _get_rag_config():
-    """Get RAG configuration with retrieval tool."""
-    if not RAG_CORPUS_NAME or types is None:
+def _init_region_router():
+    """Build the multi-region router sharing _rag_client for LOCATION."""
+    if _rag_client is None:
+        return None
+
+    def client_factory(location: str):
+        if location == LOCATION:
+            return _rag_client
+        return genai.Client(vertexai=True, project=PROJECT_ID, location=location)
+
+    corpus_access = {RAG_CORPUS_NAME: RAG_MODEL_LOCATIONS} if RAG_MODEL_LOCATIONS else {}
+    return RegionRouter(LOCATIONS, client_factory, corpus_access=corpus_access)
+
+
+_region_router = _init_region_router()
+
+
+def _get_rag_config(
+    max_output_tokens: int = 8192,
+    thinking_budget: Optional[int] = None,
+    use_retrieval: bool = True,
+    corpus: Optional[str] = None,
+    temperature: float = 1.0,
+    top_p: float = 0.95,
+):
+    """Get generation configuration, with the RAG retrieval tool unless use_retrieval is False."""
+    corpus = corpus or RAG_CORPUS_NAME
+    if not corpus or types is None:
         return None
     
     tools = [
@@ -75,17 +182,21 @@ def _get_rag_config():
             retrieval=types.Retrieval(
                 vertex_rag_store=types.VertexRagStore(
                     rag_resources=[
-                        types.VertexRagStoreRagResource(rag_corpus=RAG_CORPUS_NAME)
+                        types.VertexRagStoreRagResource(rag_corpus=corpus)
                     ],
                 )
             )
         )
-    ]
+    ] if use_retrieval else None
+    
+    extra = {}
+    if thinking_budget is not None:
+        extra["thinking_config"] = types.ThinkingConfig(thinking_budget=thinking_budget)
     
     return types.GenerateContentConfig(
-        temperature=1.0,
-        top_p=0.95,
-        max_output_tokens=8192,
+        temperature=temperature,
+        top_p=top_p,
+        max_output_tokens=max_output_tokens,
         safety_settings=[
             types.SafetySetting(category="HARM_CATEGORY_HATE_SPEECH", threshold="OFF"),
             types.SafetySetting(
@@ -97,12 +208,136 @@ def _get_rag_config():
             types.SafetySetting(category="HARM_CATEGORY_HARASSMENT", threshold="OFF"),
         ],
         tools=tools,
+        **extra,
     )
 
 
 _rag_config = _get_rag_config()
 
 
+# Generation profiles, picked per request by classify_request. Each entry is
+# (model, config); configs are built once at startup so picking one is a dict lookup.
+# Thinking budget 0 disables thinking; None keeps the model's default (dynamic).
+# Budgets are adapted per model by _thinking_budget_for.
+PROFILE_SPECS = {
+    "chat": {"max_output_tokens": 256, "thinking_budget": 0, "use_retrieval": False},
+    "quick": {"max_output_tokens": 1024, "thinking_budget": 0, "use_retrieval": True},
+    "standard": {"max_output_tokens": 4096, "thinking_budget": 1024, "use_retrieval": True},
+    "deep": {"max_output_tokens": 8192, "thinking_budget": None, "use_retrieval": True},
+}
+# A reply that hits max_output_tokens on these profiles is regenerated once with the mapped one
+PROFILE_ESCALATION = {"chat": "standard", "quick": "standard"}
+# Per-profile model override, e.g. PROFILE_CHAT_MODEL=gemini-2.5-flash-lite
+PROFILE_MODELS = {
+    name: os.getenv(f"PROFILE_{name.upper()}_MODEL", MODEL_NAME) for name in PROFILE_SPECS
+}
+ADAPTIVE_PROFILES = os.getenv("ADAPTIVE_PROFILES", "true").lower() not in ("0", "false", "no")
+
+
+def _thinking_budget_for(model: str, budget: Optional[int]) -> Optional[int]:
+    """Adapt a profile's thinking budget to what `model` accepts; None omits thinking_config.
+
+    Only the Gemini 2.5 family takes a thinking budget. 2.5 Pro can't turn thinking
+    off and needs at least 128, so 0 is raised to that minimum. Earlier models have
+    no thinking and newer ones may reject budgets, so both keep their defaults.
+    """
+    if budget is None:
+        return None
+    name = model.rsplit("/", 1)[-1].lower()
+    if not name.startswith("gemini-2.5"):
+        return None
+    if "pro" in name:
+        return max(budget, 128)
+    return budget
+
+
+def _build_profiles(
+    corpus: Optional[str] = None,
+    model: Optional[str] = None,
+    generation: Optional[dict] = None,
+    profile_models: Optional[dict] = None,
+):
+    """Build every profile's (model, config) for a corpus, optionally overriding models.
+
+    profile_models picks a model per profile, else model applies to all of them.
+    generation may set temperature / top_p and cap max_output_tokens.
+    """
+    generation = generation or {}
+    profile_models = profile_models or {}
+    profiles = {}
+    for name, spec in PROFILE_SPECS.items():
+        spec = dict(spec)
+        if "max_output_tokens" in generation:
+            spec["max_output_tokens"] = min(spec["max_output_tokens"], int(generation["max_output_tokens"]))
+        for key in ("temperature", "top_p"):
+            if key in generation:
+                spec[key] = float(generation[key])
+        profile_model = profile_models.get(name) or model or PROFILE_MODELS[name]
+        spec["thinking_budget"] = _thinking_budget_for(profile_model, spec["thinking_budget"])
+        config = _get_rag_config(corpus=corpus, **spec)
+        if config is not None:
+            profiles[name] = (profile_model, config)
+    return profiles
+
+
+_profiles = _build_profiles()
+# How often each profile was chosen since startup
+profile_counts: Dict[str, int] = {name: 0 for name in PROFILE_SPECS}
+
+_CHIT_CHAT = {
+    "hi", "hello", "hey", "yo", "thanks", "thank you", "thx", "ty", "thanks a lot",
+    "thank you so much", "ok", "okay", "cool", "great", "nice", "awesome", "got it",
+    "perfect", "bye", "good morning", "good night", "lol", "sounds good", "👍", "🙏",
+}
+_DEEP_MARKERS = (
+    "architecture", "design", "compare", "comparison", "trade-off", "tradeoff",
+    "step by step", "in detail", "explain why", "pros and cons", "difference between",
+    "walk me through", "troubleshoot", "root cause",
+)
+
+
+def classify_request(text: str) -> str:
+    """Pick a generation profile for a message using cheap local heuristics.
+
+    chat: greetings/thanks, answered without retrieval and with a tiny output budget.
+    quick: a short single question. deep: long or multi-part questions, or ones
+    asking for design/comparison/step-by-step answers. standard: everything else.
+    """
+    if not ADAPTIVE_PROFILES:
+        return "deep"
+    normalized = " ".join(text.lower().split()).strip(" .!?,:;~")
+    if not normalized:
+        return "chat"
+    if normalized in _CHIT_CHAT or normalized.rstrip("!. ") in _CHIT_CHAT:
+        return "chat"
+    words = normalized.split()
+    questions = text.count("?")
+    lines = [l for l in text.splitlines() if l.strip()]
+    if (
+        len(text) > 400
+        or questions >= 2
+        or len(lines) >= 3
+        or any(marker in normalized for marker in _DEEP_MARKERS)
+    ):
+        return "deep"
+    if len(words) <= 12:
+        return "quick"
+    return "standard"
+
+
+def _select_profile(text: str, thread_ts: str, profiles: Optional[dict] = None, record: bool = True):
+    """Return (profile name, model, config) for a message, recording the choice unless record is False."""
+    profiles = _profiles if profiles is None else profiles
+    name = classify_request(text)
+    if name not in profiles:
+        name = "deep"
+    model, config = profiles.get(name, (MODEL_NAME, _rag_config))
+    if record:
+        profile_counts[name] = profile_counts.get(name, 0) + 1
+        print(f"Profile for thread {thread_ts}: {name} (model={model})")
+    return name, model, config
+
+
 def _strip_bot_mention(text: str) -> str:
     """Remove bot mention from text."""
     if not text:
@@ -111,46 +346,356 @@ def _strip_bot_mention(text: str) -> str:
     return " ".join(part for part in text.split() if not part.startswith("<@") and not part.endswith(">")) or text
 
 
-def generate_reply_with_rag(user_text: str, thread_ts: str) -> str:
+def _trim_history(turns: Sequence[Tuple[str, str]], budget: int = HISTORY_CHAR_BUDGET) -> List[Tuple[str, str]]:
+    """Keep the most recent turns whose combined text fits within the character budget."""
+    kept: List[Tuple[str, str]] = []
+    used = 0
+    for turn in reversed(turns):
+        size = len(turn[1])
+        if kept and used + size > budget:
+            break
+        kept.append(turn)
+        used += size
+    kept.reverse()
+    return kept
+
+
+def load_thread_history(
+    client, channel: str, thread_ts: str, current_ts: str, bot_user_id: str = "", bot_id: str = ""
+) -> ThreadHistory:
+    """Return history for a thread, rebuilding it from Slack on a cache miss.
+
+    After a restart (or on another instance) the in-memory history is empty, so the
+    thread is read back with conversations_replies. Messages posted by this bot
+    (matched on bot_id / bot_user_id) become "model" turns and everything else,
+    other integrations' bots included, becomes "user" turns. Replies page forward
+    from the thread's first message, so every page up to the current mention is
+    read but only the newest turns that fit the prompt budget are kept. The result
+    is cached in conversation_history so later turns don't hit Slack again.
+    """
+    if thread_ts in conversation_history:
+        return conversation_history[thread_ts]
+
+    # Newest turns before the current mention, bounded by count and by the character budget
+    turns: Deque[Tuple[str, str]] = collections.deque(maxlen=HISTORY_FETCH_LIMIT)
+    chars = 0
+    # A mention that starts a new thread has nothing to rehydrate
+    if not channel or not thread_ts or thread_ts == current_ts:
+        return conversation_history.setdefault(thread_ts, ThreadHistory())
+
+    try:
+        cursor = None
+        while True:
+            kwargs = {"channel": channel, "ts": thread_ts, "inclusive": True, "limit": 200}
+            if current_ts:
+                kwargs["latest"] = current_ts
+            if cursor:
+                kwargs["cursor"] = cursor
+            replies = client.conversations_replies(**kwargs)
+
+            for m in replies.get("messages", []) or []:
+                ts = m.get("ts")
+                text = m.get("text")
+                if not text or not ts:
+                    continue
+                # Only include messages posted before the current mention
+                try:
+                    if current_ts and float(ts) >= float(current_ts):
+                        continue
+                except Exception:
+                    pass
+                is_bot = bool(
+                    (bot_id and m.get("bot_id") == bot_id) or (bot_user_id and m.get("user") == bot_user_id)
+                )
+                if is_bot:
+                    # Skip our own error/fallback notices, they aren't real model turns
+                    if text.startswith("⚠️") or text.startswith("👋"):
+                        continue
+                    turn = ("model", text)
+                else:
+                    user_text = _strip_bot_mention(text)
+                    if not user_text:
+                        continue
+                    turn = ("user", user_text)
+                if len(turns) == turns.maxlen:
+                    chars -= len(turns[0][1])
+                turns.append(turn)
+                chars += len(turn[1])
+                # Drop the oldest turns once the window is over budget
+                while len(turns) > 1 and chars - len(turns[0][1]) >= HISTORY_CHAR_BUDGET:
+                    chars -= len(turns.popleft()[1])
+
+            cursor = (replies.get("response_metadata") or {}).get("next_cursor")
+            if not cursor:
+                break
+    except SlackApiError as e:
+        print(f"Failed to load thread history for {thread_ts}: {e.response.get('error')}")
+    except Exception as e:
+        print(f"Failed to load thread history for {thread_ts}: {e}")
+
+    # Another listener may have populated the thread while we were fetching
+    return conversation_history.setdefault(thread_ts, ThreadHistory(_trim_history(list(turns))))
+
+
+def _to_contents(turns: List[Tuple[str, str]]) -> list:
+    """Convert (role, text) turns into Vertex Content objects."""
+    return [
+        types.Content(
+            role=role,
+            parts=[types.Part.from_text(text=text)],
+        )
+        for role, text in turns
+    ]
+
+
+_context_cache = (
+    ContextCacheManager(
+        _region_router,
+        _to_contents,
+        min_chars=CONTEXT_CACHE_MIN_CHARS,
+        ttl_seconds=CONTEXT_CACHE_TTL_SECONDS,
+    )
+    if CONTEXT_CACHE_ENABLED and _region_router is not None
+    else None
+)
+
+
+def _stream_reply_checked(
+    model: str, turns: List[Tuple[str, str]], config, location: Optional[str] = None, router=None
+) -> Tuple[str, bool]:
+    """Run a streaming generation; return (text, truncated) where truncated means it hit max_output_tokens."""
+    router = router or _region_router
+    response_text = ""
+    truncated = False
+    for chunk in router.generate_content_stream(
+        model=model, contents=_to_contents(turns), config=config, location=location
+    ):
+        if not chunk.candidates:
+            continue
+        reason = getattr(chunk.candidates[0], "finish_reason", None)
+        if reason is not None and getattr(reason, "name", reason) == "MAX_TOKENS":
+            truncated = True
+        if not chunk.candidates[0].content:
+            continue
+        if chunk.text:
+            response_text += chunk.text
+    return response_text, truncated
+
+
+def _stream_reply(model: str, turns: List[Tuple[str, str]], config, location: Optional[str] = None, router=None) -> str:
+    """Run a streaming generation over the given turns and return the concatenated text."""
+    return _stream_reply_checked(model, turns, config, location, router)[0]
+
+
+class BuiltRoute:
+    """Prebuilt objects serving one route: region router, profile configs and context cache."""
+
+    __slots__ = ("router", "profiles", "context_cache")
+
+    def __init__(self, router, profiles, context_cache):
+        self.router = router
+        self.profiles = profiles
+        self.context_cache = context_cache
+
+
+_default_route = BuiltRoute(_region_router, _profiles, _context_cache)
+# Region routers by (project, locations), shared between routes that agree on both
+_routers: Dict[Tuple[str, Tuple[str, ...]], RegionRouter] = {}
+if _region_router is not None:
+    _routers[(PROJECT_ID, tuple(LOCATIONS))] = _region_router
+
+
+def _build_route(route: Route) -> BuiltRoute:
+    """Build (once per distinct route spec) the clients and configs a route needs."""
+    if (
+        route.corpus in (None, RAG_CORPUS_NAME)
+        and not route.model
+        and not route.profile_models
+        and not route.project
+        and not route.locations
+        and not route.corpus_locations
+        and not route.generation
+    ):
+        return _default_route
+    if genai is None or types is None:
+        return _default_route
+
+    project = route.project or PROJECT_ID
+    locations = route.locations or tuple(LOCATIONS)
+    router = _routers.get((project, locations))
+    if router is None:
+        router = RegionRouter(
+            locations,
+            lambda location: genai.Client(vertexai=True, project=project, location=location),
+        )
+        _routers[(project, locations)] = router
+    corpus = route.corpus or RAG_CORPUS_NAME
+    if route.corpus_locations:
+        router.set_corpus_access(corpus, route.corpus_locations)
+    elif corpus == RAG_CORPUS_NAME and RAG_MODEL_LOCATIONS:
+        router.set_corpus_access(corpus, RAG_MODEL_LOCATIONS)
+
+    context_cache = (
+        ContextCacheManager(router, _to_contents, min_chars=CONTEXT_CACHE_MIN_CHARS, ttl_seconds=CONTEXT_CACHE_TTL_SECONDS)
+        if CONTEXT_CACHE_ENABLED
+        else None
+    )
+    print(f"Built route {route.name}: corpus={corpus} model={route.model or MODEL_NAME} project={project}")
+    return BuiltRoute(
+        router, _build_profiles(corpus, route.model, route.generation, route.profile_models), context_cache
+    )
+
+
+_route_table = RouteTable(ROUTES_FILE, _build_route, ROUTES_RELOAD_SECONDS, profiles=tuple(PROFILE_SPECS))
+
+
+_single_flight = SingleFlight()
+
+
+def _question_key(text: str, model: str, config) -> Tuple[str, str, Tuple[str, ...]]:
+    """Single-flight key: normalized question text + model + corpora in the config."""
+    normalized = " ".join(text.lower().split()).strip(" .!?,:;~")
+    return normalized, model, tuple(sorted(corpora_in_config(config)))
+
+
+_answer_cache = (
+    AnswerCache(ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_MAX_ENTRIES) if ANSWER_CACHE_ENABLED else None
+)
+
+
+def _answer_first_turn(
+    user_text: str, model: str, config, router, version: str, source: str = "live", lookup: bool = True, fallback=None
+) -> str:
+    """Answer a question with no thread context, via the answer cache and single-flight.
+
+    Used both for first-turn mentions and for cache warming, so warmed answers come
+    from exactly the same pipeline as live ones. ``fallback`` is the (model, config)
+    to regenerate with if the answer is cut off at max_output_tokens.
+    """
+    key = _question_key(user_text, model, config)
+    # Unversioned answers could outlive a corpus update, so they are never cached
+    cache = _answer_cache if version else None
+    if lookup and cache is not None:
+        cached = cache.get(key, version)
+        if cached:
+            return cached
+
+    def run() -> str:
+        turns = [("user", user_text)]
+        text, truncated = _stream_reply_checked(model, turns, config, router=router)
+        if truncated and fallback is not None:
+            print("First-turn answer hit max_output_tokens, regenerating with a larger profile")
+            text = _stream_reply(fallback[0], turns, fallback[1], router=router)
+        if text and cache is not None:
+            cache.put(key, text, version, source)
+        return text
+
+    return _single_flight.do(key, run) if SINGLE_FLIGHT_ENABLED else run()
+
+
+def warm_answer(question: str, channel: Optional[str] = None, team: Optional[str] = None) -> str:
+    """Pre-generate and cache the answer to a question; returns "warmed" or "skipped"."""
+    if _answer_cache is None:
+        raise RuntimeError("answer cache is disabled (ANSWER_CACHE_ENABLED)")
+    route, built = _route_table.built(channel, team)
+    if built.router is None or _rag_config is None:
+        raise RuntimeError("RAG engine not configured")
+    version = route.corpus_version or CORPUS_VERSION
+    if not version:
+        raise RuntimeError("no corpus version for this route; set CORPUS_VERSION or the route's corpus_version")
+    question = _strip_bot_mention(question)
+    profile, model, config = _select_profile(question, "warm-up", built.profiles, record=False)
+    if _answer_cache.contains(_question_key(question, model, config), version):
+        return "skipped"
+    fallback = built.profiles.get(PROFILE_ESCALATION.get(profile))
+    text = _answer_first_turn(
+        question, model, config, built.router, version, source="warm", lookup=False, fallback=fallback
+    )
+    if not text:
+        raise RuntimeError("no response generated")
+    return "warmed"
+
+
+def _pack_idle_threads_forever(stop: threading.Event) -> None:
+    """Compress idle threads' history every HISTORY_PACK_SWEEP_SECONDS until stop is set."""
+    while not stop.wait(HISTORY_PACK_SWEEP_SECONDS):
+        try:
+            packed = pack_idle(list(conversation_history.values()), HISTORY_PACK_IDLE_SECONDS)
+            if packed:
+                print(f"Compressed history of {packed} idle threads")
+        except Exception as e:
+            print(f"History pack sweep failed: {e}")
+
+
+def start_pack_sweeper() -> threading.Event:
+    """Start the idle-thread pack sweep on a daemon thread; set the returned event to stop it."""
+    stop = threading.Event()
+    threading.Thread(target=_pack_idle_threads_forever, args=(stop,), daemon=True, name="history-pack").start()
+    return stop
+
+
+def generate_reply_with_rag(user_text: str, thread_ts: str, channel: Optional[str] = None, team: Optional[str] = None) -> str:
     """Generate reply using Vertex AI RAG with conversation history."""
     if not user_text:
         return ""
     
-    # Fallback if RAG client isn't available
-    if _rag_client is None or _rag_config is None:
-        return "⚠️ RAG engine not configured. Please check your Vertex AI setup."
+    if PROFILING_ENABLED:
+        _inflight_generations[threading.get_ident()] = {"thread_ts": thread_ts, "started": time.time()}
     
     try:
+        # Corpus / model / settings for this channel or workspace (building a route can fail)
+        route, built = _route_table.built(channel, team)
+        router, context_cache = built.router, built.context_cache
+        version = route.corpus_version or CORPUS_VERSION
+        
+        # Fallback if RAG client isn't available
+        if router is None or _rag_config is None:
+            return "⚠️ RAG engine not configured. Please check your Vertex AI setup."
+        
         # Get or initialize conversation history for this thread
         if thread_ts not in conversation_history:
-            conversation_history[thread_ts] = []
+            conversation_history[thread_ts] = ThreadHistory()
         
         # Add user message to history
         conversation_history[thread_ts].append(("user", user_text))
         
-        # Build conversation context from history
-        contents = []
-        for role, text in conversation_history[thread_ts]:
-            contents.append(
-                types.Content(
-                    role=role,
-                    parts=[types.Part.from_text(text=text)],
-                )
-            )
+        history = conversation_history[thread_ts]
+        
+        # Pick output budget / thinking / retrieval for this message
+        profile, model, config = _select_profile(user_text, thread_ts, built.profiles)
+        
+        # Larger profile to regenerate with if a short-budget reply gets cut off
+        fallback = built.profiles.get(PROFILE_ESCALATION.get(profile))
+        truncated = False
+        
+        # Send the cached prefix by reference when there is one, else the trimmed history
+        cached = context_cache.prepare(thread_ts, model, config, history) if context_cache else None
+        if cached is not None:
+            turns, gen_config, location = cached
+            try:
+                response_text, truncated = _stream_reply_checked(model, turns, gen_config, location, router)
+            except Exception as e:
+                print(f"Cached generation failed for thread {thread_ts}, retrying uncached: {e}")
+                context_cache.invalidate(thread_ts)
+                response_text, truncated = _stream_reply_checked(model, _trim_history(history), config, router=router)
+        elif len(history) == 1 and (SINGLE_FLIGHT_ENABLED or (_answer_cache is not None and version)):
+            # First turn carries no thread context: serve from the answer cache, or share one
+            # call between identical concurrent questions
+            response_text = _answer_first_turn(user_text, model, config, router, version, fallback=fallback)
+        else:
+            response_text, truncated = _stream_reply_checked(model, _trim_history(history), config, router=router)
         
-        # Generate response with streaming
-        response_text = ""
-        for chunk in _rag_client.models.generate_content_stream(
-            model=MODEL_NAME, contents=contents, config=_rag_config
-        ):
-            if not chunk.candidates or not chunk.candidates[0].content:
-                continue
-            if chunk.text:
-                response_text += chunk.text
+        if truncated and fallback is not None:
+            print(f"Reply for thread {thread_ts} hit max_output_tokens on {profile}, regenerating")
+            model, config = fallback
+            response_text = _stream_reply(model, _trim_history(history), config, router=router)
         
         # Add assistant response to history
         if response_text:
-            conversation_history[thread_ts].append(("model", response_text))
+            history.append(("model", response_text))
+            if context_cache is not None:
+                window_start = len(history) - len(_trim_history(history))
+                context_cache.update_after_turn(thread_ts, model, config, history, window_start)
             return response_text
         
         return "⚠️ No response generated."
@@ -162,10 +707,18 @@ def generate_reply_with_rag(user_text: str, thread_ts: str) -> str:
         if thread_ts in conversation_history and conversation_history[thread_ts] and conversation_history[thread_ts][-1][0] == "user":
             conversation_history[thread_ts].pop()
         return f"⚠️ Sorry, I encountered an error. Please try again."
+    
+    finally:
+        if PROFILING_ENABLED:
+            _inflight_generations.pop(threading.get_ident(), None)
+
+
+# Event types with a listener below; anything else is acked in slack_events() without Bolt dispatch
+HANDLED_EVENT_TYPES = {"app_mention"}
 
 
 @slack_app.event("app_mention")
-def handle_app_mention(body, say):
+def handle_app_mention(body, say, client, context):
     """Handle app mentions with Gemini RAG."""
     event = body.get("event", {}) or {}
     channel = event.get("channel")
@@ -179,8 +732,14 @@ def handle_app_mention(body, say):
         say(text="👋 Hi! How can I help you?", thread_ts=thread_ts)
         return
     
+    # Rehydrate thread context if this instance hasn't seen the thread yet
+    load_thread_history(
+        client, channel, thread_ts, event.get("ts"), context.get("bot_user_id") or "", context.get("bot_id") or ""
+    )
+    
     # Generate reply using Gemini RAG
-    reply = generate_reply_with_rag(user_message, thread_ts)
+    team = body.get("team_id") or event.get("team")
+    reply = generate_reply_with_rag(user_message, thread_ts, channel, team)
     
     if reply:
         say(text=reply, thread_ts=thread_ts)
@@ -191,7 +750,14 @@ def handle_app_mention(body, say):
 # Flask app
 flask_app = Flask(__name__)
 CORS(flask_app)
-handler = SlackRequestHandler(slack_app)
+signature_verifier = SignatureVerifier(os.getenv("SLACK_SIGNING_SECRET", ""))
+traffic_capture = (
+  TrafficCapture(SLACK_CAPTURE_PATH, SLACK_CAPTURE_MAX_BYTES, SLACK_CAPTURE_BACKUPS)
+  if SLACK_CAPTURE_PATH else None
+)
+if traffic_capture is not None:
+  # Closing writes the gzip end marker, so the file reads cleanly after shutdown
+  atexit.register(traffic_capture.close)
 
 
 @flask_app.get("/health")
@@ -201,7 +767,7 @@ def health():
 
 @flask_app.get("/api/ping")
 def ping():
-  return jsonify({"ok": True, "ts": int(__import__("time").time() * 1000)})
+  return jsonify({"ok": True, "ts": int(time.time() * 1000)})
 
 
 @flask_app.post("/api/notify")
@@ -218,12 +784,271 @@ def notify():
     return jsonify({"ok": False, "error": str(e)}), 500
 
 
-@flask_app.post("/slack/events")
+# Message subtypes that never carry a user question (edits, deletes, joins, bot posts, ...);
+# thread_broadcast and message_replied are real user posts and still go to Bolt
+IGNORED_SUBTYPES = {
+  "message_changed", "message_deleted", "bot_message",
+  "channel_join", "channel_leave", "channel_topic", "channel_purpose", "channel_name",
+  "group_join", "group_leave", "tombstone",
+}
+
+# How many /slack/events requests were acked early (by reason) or dispatched to Bolt
+event_filter_counts: Dict[str, int] = {}
+_event_filter_lock = threading.Lock()
+
+
+def _count_event(reason: str) -> None:
+  with _event_filter_lock:
+    event_filter_counts[reason] = event_filter_counts.get(reason, 0) + 1
+
+
+_own_bot_id: Optional[str] = None
+_own_bot_id_lock = threading.Lock()
+
+
+def _get_own_bot_id() -> str:
+  """Return this app's bot_id from auth.test, looked up once; empty if the lookup fails."""
+  global _own_bot_id
+  if _own_bot_id is None:
+    with _own_bot_id_lock:
+      if _own_bot_id is None:
+        try:
+          _own_bot_id = slack_app.client.auth_test().get("bot_id") or ""
+        except Exception as e:
+          print(f"auth.test failed, not filtering own bot_id yet: {e}")
+          return ""
+  return _own_bot_id
+
+
+def _event_drop_reason(body: dict, headers) -> Optional[str]:
+  """Return why an already-verified JSON event can be acked without dispatch, or None to dispatch."""
+  if body.get("type") != "event_callback":
+    # url_verification needs Bolt to answer the challenge; other envelope types are ignored
+    return None if body.get("type") == "url_verification" else "envelope_type"
+  # Retries after a timeout duplicate a request this service already received
+  if headers.get("X-Slack-Retry-Num") and headers.get("X-Slack-Retry-Reason") == "http_timeout":
+    return "retry"
+  event = body.get("event") or {}
+  if event.get("type") not in HANDLED_EVENT_TYPES:
+    return "event_type"
+  if event.get("subtype") in IGNORED_SUBTYPES or event.get("edited"):
+    return "subtype"
+  bot_user_ids = {a.get("user_id") for a in body.get("authorizations") or [] if a.get("is_bot")}
+  # Only this app's own posts; mentions from other bots and workflows are still answered
+  if event.get("user") and event.get("user") in bot_user_ids:
+    return "self"
+  if event.get("bot_id") and event.get("bot_id") == _get_own_bot_id():
+    return "self"
+  return None
+
+
 def slack_events():
-  return handler.handle(request)
+  raw_body = request.get_data(as_text=True)
+  if traffic_capture is not None:
+    traffic_capture.record(dict(request.headers), raw_body, time.time())
+
+  if not signature_verifier.is_valid_request(raw_body, dict(request.headers)):
+    _count_event("invalid_signature")
+    return jsonify({"error": "invalid request"}), 401
+
+  # Parse JSON event payloads to decide on the fast path; only dispatched events are parsed
+  # again by Bolt, which needs the raw body in HTTP mode (lazy listeners re-dispatch from it)
+  if (request.content_type or "").startswith("application/json"):
+    try:
+      body = json.loads(raw_body) if raw_body else {}
+    except ValueError:
+      _count_event("bad_json")
+      return "", 400
+    reason = _event_drop_reason(body, request.headers)
+    if reason:
+      _count_event(reason)
+      return "", 200
+
+  _count_event("dispatched")
+  bolt_req = BoltRequest(
+    body=raw_body,
+    query=request.query_string.decode("utf-8"),
+    headers=dict(request.headers),
+  )
+  return to_flask_response(slack_app.dispatch(bolt_req))
+
+
+# In Socket Mode there is no signing secret to check requests against, so the endpoint isn't served
+if SLACK_MODE != "socket":
+  flask_app.post("/slack/events")(slack_events)
+
+
+@flask_app.get("/api/event-stats")
+def event_stats():
+  with _event_filter_lock:
+    counts = dict(event_filter_counts)
+  result = {"ok": True, "counts": counts}
+  if socket_mode_runner is not None:
+    result["socket_mode"] = socket_mode_runner.snapshot()
+  if _answer_cache is not None:
+    result["answer_cache"] = _answer_cache.snapshot()
+  return jsonify(result)
+
+
+def _admin_authorized(token: str) -> bool:
+  supplied = request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+  return bool(token) and hmac.compare_digest(supplied, token)
+
+
+class _BadAdminParam(ValueError):
+  """An admin endpoint parameter that can't be used; answered with 400."""
+
+
+@flask_app.errorhandler(_BadAdminParam)
+def _bad_admin_param(e):
+  return jsonify({"ok": False, "error": str(e)}), 400
+
+
+def _admin_number(name: str, value, cast, low, high):
+  """Parse an admin parameter with cast and clamp it to [low, high]; raise _BadAdminParam if it isn't a number."""
+  try:
+    number = cast(value)
+  except (TypeError, ValueError):
+    raise _BadAdminParam(f"{name} must be a number, got {value!r}") from None
+  if isinstance(value, bool) or math.isnan(number):
+    raise _BadAdminParam(f"{name} must be a number, got {value!r}")
+  return min(max(number, low), high)
+
+
+@flask_app.before_request
+def _guard_admin():
+  # Warming and profiling have separate tokens, so granting one doesn't expose the other
+  if not request.path.startswith("/admin/"):
+    return None
+  token = WARM_ADMIN_TOKEN if request.path == "/admin/warm" else ADMIN_PROFILING_TOKEN
+  if not _admin_authorized(token):
+    return jsonify({"ok": False, "error": "unauthorized"}), 401
+  return None
+
+
+# tracemalloc statistics groupings accepted by /admin/heap/snapshot?key=
+HEAP_SNAPSHOT_KEYS = ("lineno", "filename", "traceback")
+
+
+if PROFILING_ENABLED:
+  _heap_tracker = profiling.HeapTracker()
+
+  @flask_app.get("/admin/profile/cpu")
+  def admin_profile_cpu():
+    """Sample all threads for ?seconds=N (max 60) and return folded stacks for a flame graph."""
+    seconds = _admin_number("seconds", request.args.get("seconds", "10"), float, 0.1, 60.0)
+    interval = _admin_number("interval_ms", request.args.get("interval_ms", "5"), float, 1.0, 100.0) / 1000.0
+    return Response(profiling.sample_cpu(seconds, interval), mimetype="text/plain")
+
+  @flask_app.post("/admin/heap/start")
+  def admin_heap_start():
+    _heap_tracker.start(_admin_number("frames", request.args.get("frames", "10"), int, 1, 100))
+    return jsonify({"ok": True})
+
+  @flask_app.post("/admin/heap/stop")
+  def admin_heap_stop():
+    _heap_tracker.stop()
+    return jsonify({"ok": True})
+
+  @flask_app.get("/admin/heap/snapshot")
+  def admin_heap_snapshot():
+    """Top allocation sites, growth since the previous snapshot, and sizes of in-memory state."""
+    limit = _admin_number("limit", request.args.get("limit", "25"), int, 1, 1000)
+    key = request.args.get("key", "lineno")
+    if key not in HEAP_SNAPSHOT_KEYS:
+      raise _BadAdminParam(f"key must be one of {', '.join(HEAP_SNAPSHOT_KEYS)}, got {key!r}")
+    try:
+      result = _heap_tracker.snapshot(limit, key)
+    except RuntimeError as e:
+      return jsonify({"ok": False, "error": str(e)}), 409
+    # Sizing walks the slots directly, so packed threads are not unpacked
+    history = dict(conversation_history)
+    result["structures"] = {
+      "conversation_history": {
+        "threads": len(history),
+        "packed_threads": sum(1 for v in history.values() if v.is_packed),
+        "turns": sum(len(v) for v in history.values()),
+        "bytes": profiling.deep_sizeof(history),
+      },
+    }
+    return jsonify({"ok": True, **result})
+
+  @flask_app.get("/admin/stacks")
+  def admin_stacks():
+    """Stacks of in-flight generation workers (?all=1 for every thread)."""
+    now = time.time()
+    if request.args.get("all"):
+      return jsonify({"ok": True, "threads": profiling.thread_stacks()})
+    inflight = {
+      ident: {"thread_ts": info["thread_ts"], "running_s": round(now - info["started"], 3)}
+      for ident, info in list(_inflight_generations.items())
+    }
+    return jsonify({"ok": True, "threads": profiling.thread_stacks(inflight)})
+
+
+# Most recent cache-warming job (startup or POST /admin/warm)
+_warm_job: Optional[WarmJob] = None
+
+
+if WARM_ADMIN_TOKEN:
+  @flask_app.post("/admin/warm")
+  def admin_warm():
+    """Start warming the answer cache for {"questions": [...]} (strings or {"question", "channel", "team"})."""
+    global _warm_job
+    if _answer_cache is None:
+      return jsonify({"ok": False, "error": "answer cache is disabled (ANSWER_CACHE_ENABLED)"}), 409
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+      return jsonify({"ok": False, "error": "body must be a JSON object"}), 400
+    concurrency = _admin_number("concurrency", data.get("concurrency") or WARM_CONCURRENCY, int, 1, 64)
+    raw_questions = data.get("questions") or []
+    if not isinstance(raw_questions, list):
+      return jsonify({"ok": False, "error": "questions must be a list"}), 400
+    questions = [q if isinstance(q, dict) else {"question": str(q)} for q in raw_questions]
+    questions = [q for q in questions if isinstance(q.get("question"), str) and q["question"].strip()]
+    if not questions:
+      return jsonify({"ok": False, "error": "questions is required"}), 400
+    if _warm_job is not None and _warm_job.snapshot()["running"]:
+      return jsonify({"ok": False, "error": "a warm-up is already running", "progress": _warm_job.snapshot()}), 409
+    _warm_job = WarmJob(questions, warm_answer, concurrency)
+    _warm_job.start()
+    return jsonify({"ok": True, "progress": _warm_job.snapshot()}), 202
+
+  @flask_app.get("/admin/warm")
+  def admin_warm_status():
+    return jsonify({
+      "ok": True,
+      "progress": _warm_job.snapshot() if _warm_job is not None else None,
+      "answer_cache": _answer_cache.snapshot() if _answer_cache is not None else None,
+    })
+
+
+socket_mode_runner = None
+if SLACK_MODE == "socket":
+  from socket_mode import SocketModeRunner
+
+  socket_mode_runner = SocketModeRunner(
+    slack_app,
+    os.getenv("SLACK_APP_TOKEN", ""),
+    workers=int(os.getenv("SOCKET_MODE_WORKERS", "8")),
+    queue_size=int(os.getenv("SOCKET_MODE_QUEUE_SIZE", "32")),
+    drop_reason=_event_drop_reason,
+  )
 
 
 if __name__ == "__main__":
+  # Cloud Run / docker stop send SIGTERM; exit normally so atexit hooks run
+  signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+  if socket_mode_runner is not None:
+    socket_mode_runner.start()
+  start_pack_sweeper()
+  if WARM_QUESTIONS_FILE and _answer_cache is not None:
+    try:
+      _warm_job = WarmJob(load_questions(WARM_QUESTIONS_FILE), warm_answer, WARM_CONCURRENCY)
+      _warm_job.start()
+    except OSError as e:
+      print(f"Could not read WARM_QUESTIONS_FILE {WARM_QUESTIONS_FILE}: {e}")
+  # Still serve HTTP in Socket Mode for /health, /api/* and admin endpoints
   flask_app.run(host="0.0.0.0", port=PORT)
 
 
@@ -0,0 +1,233 @@
+"""Explicit Vertex context caching for long Slack threads.
+
+Once a thread's history is long enough, its stable prefix (all turns up to the
+last model answer, plus the retrieval tool config) is stored as a cached-content
+entry. Later turns send only the turns after that prefix and reference the
+cache, which cuts input-token cost and time to first token.
+
+Caches are created in the background after a reply, so no user waits on it.
+They live in one region, so turns that use a cache are pinned to that region;
+if the pinned call fails, the caller drops the entry and retries uncached.
+Entries keep a TTL that is extended while the thread is active. An entry is
+replaced when the uncached tail grows past a threshold, and the least recently
+used entries are deleted once there are too many.
+
+The manager only needs ``router.ranked()``, ``router.client(location)`` and the
+client's ``caches.create/update/delete``, so a local fake of the caching API
+is enough to test it.
+"""
+import collections
+import hashlib
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+try:
+    from google.genai import types
+except Exception:
+    types = None
+
+from region_router import corpora_in_config
+
+Turn = Tuple[str, str]
+
+
+def _turns_chars(turns: Sequence[Turn]) -> int:
+    return sum(len(text) for _role, text in turns)
+
+
+def _turns_digest(turns: Sequence[Turn]) -> str:
+    h = hashlib.sha1()
+    for role, text in turns:
+        h.update(role.encode("utf-8"))
+        h.update(b"\0")
+        h.update(text.encode("utf-8"))
+        h.update(b"\1")
+    return h.hexdigest()
+
+
+def _config_signature(config) -> str:
+    """Identify the parts of a config that are baked into a cache (tools, system instruction)."""
+    system = getattr(config, "system_instruction", None)
+    return f"{sorted(corpora_in_config(config))}|{system!r}"
+
+
+class CacheEntry:
+    __slots__ = ("name", "location", "model", "config_sig", "start", "count", "digest", "expires_at", "hits")
+
+    def __init__(self, name, location, model, config_sig, start, count, digest, expires_at):
+        self.name = name
+        self.location = location
+        self.model = model
+        self.config_sig = config_sig
+        # history[start:start + count] is what the cache holds
+        self.start = start
+        self.count = count
+        self.digest = digest
+        self.expires_at = expires_at
+        self.hits = 0
+
+
+class ContextCacheManager:
+    def __init__(
+        self,
+        router,
+        to_contents: Callable[[Sequence[Turn]], list],
+        min_chars: int = 16000,
+        refresh_tail_chars: int = 8000,
+        ttl_seconds: int = 3600,
+        max_entries: int = 200,
+        clock: Callable[[], float] = time.time,
+    ):
+        self._router = router
+        self._to_contents = to_contents
+        self.min_chars = min_chars
+        self.refresh_tail_chars = refresh_tail_chars
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries: "collections.OrderedDict[str, CacheEntry]" = collections.OrderedDict()
+        self._creating: set = set()
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "created": 0, "create_errors": 0, "invalidated": 0}
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def _valid_entry(self, key: str, model: str, config, history: Sequence[Turn]) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        end = entry.start + entry.count
+        if (
+            entry.expires_at <= self._clock()
+            or entry.model != model
+            or entry.config_sig != _config_signature(config)
+            or end > len(history)
+            or _turns_digest(history[entry.start:end]) != entry.digest
+        ):
+            return None
+        return entry
+
+    def prepare(self, key: str, model: str, config, history: Sequence[Turn]):
+        """Return (turns to send, config, pinned location) on a cache hit, else None.
+
+        ``history`` is the thread's full history including the new user turn. On a
+        hit, only the turns after the cached prefix are sent and the config
+        references the cache instead of carrying tools itself.
+        """
+        entry = self._valid_entry(key, model, config, history)
+        if entry is None:
+            self._count("misses")
+            return None
+        self._count("hits")
+        with self._lock:
+            entry.hits += 1
+            self._entries.move_to_end(key)
+        self._extend_ttl_async(entry)
+        cached_config = config.model_copy(
+            update={"tools": None, "tool_config": None, "system_instruction": None, "cached_content": entry.name}
+        )
+        return list(history[entry.start + entry.count:]), cached_config, entry.location
+
+    def invalidate(self, key: str) -> None:
+        """Forget and delete a thread's cache (e.g. after a failed cached call)."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._count("invalidated")
+            self._delete_async(entry)
+
+    def update_after_turn(self, key: str, model: str, config, history: Sequence[Turn], window_start: int = 0) -> None:
+        """Cache the thread prefix in the background if it is big enough and not already covered.
+
+        ``window_start`` is the first turn of ``history`` that would be sent without
+        caching (after prompt-budget trimming); the cache covers history[window_start:].
+        """
+        window = history[window_start:]
+        if _turns_chars(window) < self.min_chars or types is None:
+            return
+        # Chit-chat profiles without retrieval shouldn't replace the thread's RAG cache
+        if not corpora_in_config(config):
+            return
+        entry = self._valid_entry(key, model, config, history)
+        if entry is not None and _turns_chars(history[entry.start + entry.count:]) < self.refresh_tail_chars:
+            return
+        with self._lock:
+            if key in self._creating:
+                return
+            self._creating.add(key)
+        snapshot = list(window)
+        threading.Thread(
+            target=self._create, args=(key, model, config, snapshot, window_start), daemon=True,
+            name=f"context-cache-{key}",
+        ).start()
+
+    def _create(self, key: str, model: str, config, turns: List[Turn], start: int) -> None:
+        try:
+            location = self._router.ranked(corpora_in_config(config))[0]
+            client = self._router.client(location)
+            cache = client.caches.create(
+                model=model,
+                config=types.CreateCachedContentConfig(
+                    contents=self._to_contents(turns),
+                    tools=getattr(config, "tools", None),
+                    system_instruction=getattr(config, "system_instruction", None),
+                    ttl=f"{self.ttl_seconds}s",
+                    display_name=f"slack-thread-{key}"[:128],
+                ),
+            )
+            entry = CacheEntry(
+                cache.name, location, model, _config_signature(config), start, len(turns),
+                _turns_digest(turns), self._clock() + self.ttl_seconds,
+            )
+            evicted = []
+            with self._lock:
+                old = self._entries.pop(key, None)
+                if old is not None:
+                    evicted.append(old)
+                self._entries[key] = entry
+                while len(self._entries) > self.max_entries:
+                    evicted.append(self._entries.popitem(last=False)[1])
+            for old in evicted:
+                self._delete_async(old)
+            self._count("created")
+        except Exception as e:
+            self._count("create_errors")
+            print(f"Context cache creation failed for {key}: {e}")
+        finally:
+            with self._lock:
+                self._creating.discard(key)
+
+    def _extend_ttl_async(self, entry: CacheEntry) -> None:
+        # Only extend once less than half the TTL is left, to avoid an update call per turn
+        if entry.expires_at - self._clock() > self.ttl_seconds / 2:
+            return
+        entry.expires_at = self._clock() + self.ttl_seconds
+
+        def run():
+            try:
+                self._router.client(entry.location).caches.update(
+                    name=entry.name, config=types.UpdateCachedContentConfig(ttl=f"{self.ttl_seconds}s")
+                )
+            except Exception as e:
+                # Let it lapse; the next turn falls back to uncached once it expires
+                entry.expires_at = 0
+                print(f"Context cache TTL update failed for {entry.name}: {e}")
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _delete_async(self, entry: CacheEntry) -> None:
+        def run():
+            try:
+                self._router.client(entry.location).caches.delete(name=entry.name)
+            except Exception as e:
+                print(f"Context cache delete failed for {entry.name}: {e}")
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), **self.stats}
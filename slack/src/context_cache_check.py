@@ -0,0 +1,270 @@
+"""Check ContextCacheManager against a local fake of the Vertex caching API.
+
+A fake router stands in for RegionRouter: ``client(location).caches`` records
+create/update/delete calls and hands out cache names, and
+``generate_content_stream`` records what each generation call sent. The checks:
+
+  hit        once a long thread is cached, the next turn sends only the turns
+             after the cached prefix, references the cache and carries no
+             tools of its own
+  refresh    the entry is kept while the uncached tail is short and replaced
+             (the old one deleted) once the tail grows past the threshold
+  eviction   past max_entries the least recently used entry is deleted
+  fallback   when the cached call fails, app.generate_reply_with_rag drops the
+             entry and answers with an uncached call over the thread history
+
+Usage:
+    python context_cache_check.py           # run every check
+    python context_cache_check.py fallback  # run one
+"""
+import argparse
+import sys
+import threading
+import time
+from types import SimpleNamespace
+from typing import Callable, Dict, List
+
+from google.genai import types
+
+from context_cache import ContextCacheManager
+
+MODEL = "gemini-2.5-flash"
+CORPUS = "projects/check/locations/us-central1/ragCorpora/1"
+LOCATION = "us-central1"
+
+
+class FakeCaches:
+    """Records caches.create/update/delete calls like client.caches on a genai Client."""
+
+    def __init__(self):
+        self.created: List[SimpleNamespace] = []
+        self.updated: List[str] = []
+        self.deleted: List[str] = []
+        self._lock = threading.Lock()
+
+    def create(self, model, config):
+        with self._lock:
+            name = f"cachedContents/check-{len(self.created) + 1}"
+            self.created.append(SimpleNamespace(
+                name=name, model=model, contents=len(config.contents), tools=config.tools, ttl=config.ttl,
+            ))
+        return SimpleNamespace(name=name)
+
+    def update(self, name, config):
+        with self._lock:
+            self.updated.append(name)
+
+    def delete(self, name):
+        with self._lock:
+            self.deleted.append(name)
+
+
+class FakeCacheRouter:
+    """Stands in for RegionRouter: one region, a fake caches API and a recording generate call."""
+
+    def __init__(self):
+        self.caches = FakeCaches()
+        self.calls: List[dict] = []
+        self.fail_cached = False
+        self._lock = threading.Lock()
+
+    def ranked(self, corpora=None):
+        return [LOCATION]
+
+    def client(self, location):
+        return SimpleNamespace(caches=self.caches)
+
+    def generate_content_stream(self, model, contents, config=None, location=None):
+        cached_content = getattr(config, "cached_content", None)
+        with self._lock:
+            self.calls.append({
+                "contents": len(contents), "cached_content": cached_content,
+                "tools": getattr(config, "tools", None), "location": location,
+            })
+        if cached_content and self.fail_cached:
+            raise RuntimeError(f"{cached_content} not found")
+        text = "checked answer. "
+        yield SimpleNamespace(text=text, candidates=[SimpleNamespace(content=text)])
+
+
+def _to_contents(turns) -> list:
+    return [types.Content(role=role, parts=[types.Part.from_text(text=text)]) for role, text in turns]
+
+
+def _rag_config() -> types.GenerateContentConfig:
+    return types.GenerateContentConfig(
+        max_output_tokens=4096,
+        tools=[types.Tool(retrieval=types.Retrieval(vertex_rag_store=types.VertexRagStore(
+            rag_resources=[types.VertexRagStoreRagResource(rag_corpus=CORPUS)],
+        )))],
+    )
+
+
+def _thread(turn_pairs: int, chars: int = 400, tag: str = "") -> List[tuple]:
+    turns = []
+    for i in range(turn_pairs):
+        turns.append(("user", f"{tag} question {i} " + "q" * chars))
+        turns.append(("model", f"{tag} answer {i} " + "a" * chars))
+    return turns
+
+
+def _wait_for(predicate: Callable[[], bool], timeout: float = 5.0) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return predicate()
+
+
+def _manager(router: FakeCacheRouter, **kwargs) -> ContextCacheManager:
+    kwargs = {"min_chars": 1000, "refresh_tail_chars": 2000, **kwargs}
+    return ContextCacheManager(router, _to_contents, **kwargs)
+
+
+def check_hit() -> None:
+    router = FakeCacheRouter()
+    manager = _manager(router)
+    config = _rag_config()
+    history = _thread(3)
+    manager.update_after_turn("T1", MODEL, config, history)
+    assert _wait_for(lambda: manager.stats["created"] == 1), f"cache was never created: {manager.snapshot()}"
+    created = router.caches.created[0]
+    assert created.contents == len(history), f"cache holds {created.contents} turns, expected {len(history)}"
+    assert created.tools, "retrieval tools were not stored in the cache"
+
+    history = history + [("user", "a new question")]
+    prepared = manager.prepare("T1", MODEL, config, history)
+    assert prepared is not None, "no cache hit for a covered thread"
+    turns, cached_config, location = prepared
+    assert turns == [("user", "a new question")], f"expected only the new turn, got {len(turns)} turns"
+    assert cached_config.cached_content == created.name, cached_config.cached_content
+    assert cached_config.tools is None and cached_config.tool_config is None, "cached call still carries tools"
+    assert cached_config.max_output_tokens == config.max_output_tokens, "generation settings were not kept"
+    assert location == LOCATION, location
+    assert config.tools and config.cached_content is None, "prepare changed the caller's config"
+
+    # A different model or corpus can't use the entry
+    assert manager.prepare("T1", "gemini-2.5-pro", config, history) is None, "hit for a different model"
+    assert manager.prepare("T1", MODEL, types.GenerateContentConfig(), history) is None, "hit without the tools"
+    print(f"  cached {created.contents} turns; the next turn sent 1 turn with cached_content={created.name}")
+
+
+def check_refresh() -> None:
+    router = FakeCacheRouter()
+    manager = _manager(router, refresh_tail_chars=2000)
+    config = _rag_config()
+    history = _thread(3)
+    manager.update_after_turn("T1", MODEL, config, history)
+    assert _wait_for(lambda: manager.stats["created"] == 1), f"cache was never created: {manager.snapshot()}"
+    first = router.caches.created[0].name
+
+    # A short tail keeps the entry
+    history = history + _thread(1, chars=300, tag="short")
+    manager.update_after_turn("T1", MODEL, config, history)
+    time.sleep(0.2)
+    assert manager.stats["created"] == 1, "entry was replaced for a short tail"
+    assert len(manager.prepare("T1", MODEL, config, history + [("user", "q")])[0]) == 3
+
+    # A long tail replaces it, and the old entry is deleted
+    history = history + _thread(2, chars=600, tag="long")
+    manager.update_after_turn("T1", MODEL, config, history)
+    assert _wait_for(lambda: manager.stats["created"] == 2), f"entry was not refreshed: {manager.snapshot()}"
+    assert _wait_for(lambda: first in router.caches.deleted), "replaced entry was not deleted"
+    turns, cached_config, _location = manager.prepare("T1", MODEL, config, history + [("user", "q")])
+    second = router.caches.created[1]
+    assert cached_config.cached_content == second.name, cached_config.cached_content
+    assert turns == [("user", "q")], f"tail after refresh is {len(turns)} turns"
+    assert second.contents == len(history), f"refreshed cache holds {second.contents} of {len(history)} turns"
+    print(f"  kept {first} for a short tail, replaced it with {second.name} once the tail grew")
+
+
+def check_eviction() -> None:
+    router = FakeCacheRouter()
+    manager = _manager(router, max_entries=2)
+    config = _rag_config()
+    threads: Dict[str, List[tuple]] = {key: _thread(3, tag=key) for key in ("A", "B", "C")}
+    names: Dict[str, str] = {}
+    for key in ("A", "B"):
+        manager.update_after_turn(key, MODEL, config, threads[key])
+        assert _wait_for(lambda: manager.stats["created"] == len(names) + 1), f"{key} was not cached"
+        names[key] = router.caches.created[-1].name
+
+    # Using A makes B the least recently used entry
+    assert manager.prepare("A", MODEL, config, threads["A"] + [("user", "q")]) is not None
+    manager.update_after_turn("C", MODEL, config, threads["C"])
+    assert _wait_for(lambda: manager.stats["created"] == 3), f"C was not cached: {manager.snapshot()}"
+    assert _wait_for(lambda: names["B"] in router.caches.deleted), f"B was not deleted: {router.caches.deleted}"
+    assert names["A"] not in router.caches.deleted, "the recently used entry was evicted"
+    assert manager.snapshot()["entries"] == 2, manager.snapshot()
+    assert manager.prepare("B", MODEL, config, threads["B"] + [("user", "q")]) is None, "evicted entry still hit"
+    assert manager.prepare("A", MODEL, config, threads["A"] + [("user", "q")]) is not None, "A was lost"
+    print(f"  max_entries=2: caching a third thread deleted the least recently used one ({names['B']})")
+
+
+def check_fallback() -> None:
+    from replay import start_local_app
+
+    _url, _secret, fake_slack, server = start_local_app(0)
+    import app
+
+    router = FakeCacheRouter()
+    manager = _manager(router)
+    config = _rag_config()
+    route = app._default_route
+    saved = (route.router, route.profiles, route.context_cache)
+    route.router, route.context_cache = router, manager
+    route.profiles = {name: (MODEL, config) for name in app.PROFILE_SPECS}
+    try:
+        thread_ts = f"{time.time():.6f}"
+        history = app.ThreadHistory()
+        for turn in _thread(3):
+            history.append(turn)
+        app.conversation_history[thread_ts] = history
+        manager.update_after_turn(thread_ts, MODEL, config, history)
+        assert _wait_for(lambda: manager.stats["created"] == 1), f"cache was never created: {manager.snapshot()}"
+        name = router.caches.created[0].name
+
+        router.fail_cached = True
+        reply = app.generate_reply_with_rag("Can you explain how the retry policy works?", thread_ts)
+        assert reply == "checked answer. ", f"unexpected reply: {reply!r}"
+        assert len(router.calls) == 2, f"expected a cached call then an uncached one, got {router.calls}"
+        cached_call, uncached_call = router.calls
+        assert cached_call["cached_content"] == name and cached_call["contents"] == 1, cached_call
+        assert uncached_call["cached_content"] is None and uncached_call["tools"], uncached_call
+        assert uncached_call["contents"] == len(_thread(3)) + 1, f"uncached call sent {uncached_call['contents']} turns"
+        assert manager.stats["invalidated"] == 1, manager.snapshot()
+        assert _wait_for(lambda: name in router.caches.deleted), "failed entry was not deleted"
+        assert history[-1] == ("model", reply), "reply was not stored in the thread history"
+        print(f"  cached call failed; entry {name} dropped and the reply came from an uncached call")
+    finally:
+        route.router, route.profiles, route.context_cache = saved
+        server.shutdown()
+        fake_slack.close()
+
+
+CHECKS = {"hit": check_hit, "refresh": check_refresh, "eviction": check_eviction, "fallback": check_fallback}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check ContextCacheManager against a local fake caching API")
+    parser.add_argument("checks", nargs="*", help=f"checks to run: {', '.join(CHECKS)} (default: all)")
+    args = parser.parse_args()
+    unknown = [name for name in args.checks if name not in CHECKS]
+    if unknown:
+        parser.error(f"unknown checks: {', '.join(unknown)}")
+
+    failed = 0
+    for name in args.checks or list(CHECKS):
+        print(f"{name}:")
+        try:
+            CHECKS[name]()
+            print("  ok")
+        except AssertionError as e:
+            failed += 1
+            print(f"  FAILED: {e}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
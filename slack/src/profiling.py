@@ -0,0 +1,117 @@
+"""Live profiling helpers behind the /admin endpoints in app.py.
+
+Nothing here runs unless an admin endpoint is called: the CPU sampler only
+exists for the duration of a request, and tracemalloc is only started on demand.
+"""
+import collections
+import sys
+import threading
+import time
+import tracemalloc
+import traceback
+from typing import Dict, List, Optional
+
+
+def _frame_stack(frame) -> List[str]:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def sample_cpu(seconds: float, interval: float = 0.005) -> str:
+    """Sample every thread's stack for `seconds` and return folded stacks.
+
+    The output is the "collapsed" format (one `thread;frame;frame count` line per
+    unique stack) read by flamegraph.pl, speedscope and most flame graph viewers.
+    The sampler's own thread is excluded.
+    """
+    me = threading.get_ident()
+    names = {}
+    counts: Dict[str, int] = collections.Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        if len(names) != threading.active_count():
+            names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = _frame_stack(frame)
+            counts[";".join([names.get(ident, str(ident))] + stack)] += 1
+        time.sleep(interval)
+    return "\n".join(f"{stack} {n}" for stack, n in sorted(counts.items(), key=lambda kv: -kv[1])) + "\n"
+
+
+def thread_stacks(only: Optional[Dict[int, dict]] = None) -> List[dict]:
+    """Current stack of every thread, or just the thread idents in `only` (with their metadata)."""
+    names = {t.ident: t.name for t in threading.enumerate()}
+    result = []
+    for ident, frame in sys._current_frames().items():
+        if only is not None and ident not in only:
+            continue
+        entry = {"thread": names.get(ident, str(ident)), "ident": ident, "stack": traceback.format_stack(frame)}
+        if only is not None:
+            entry.update(only[ident])
+        result.append(entry)
+    return result
+
+
+class HeapTracker:
+    """On-demand tracemalloc snapshots; each snapshot is diffed against the previous one."""
+
+    def __init__(self):
+        self._last: Optional[tracemalloc.Snapshot] = None
+        self._lock = threading.Lock()
+
+    def start(self, frames: int = 10) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+    def stop(self) -> None:
+        with self._lock:
+            self._last = None
+        tracemalloc.stop()
+
+    def snapshot(self, limit: int = 25, key_type: str = "lineno") -> dict:
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc is not running; POST /admin/heap/start first")
+        snap = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap>")]
+        )
+        current, peak = tracemalloc.get_traced_memory()
+        result = {
+            "traced_bytes": current,
+            "peak_bytes": peak,
+            "top": [
+                {"where": str(stat.traceback), "size_bytes": stat.size, "count": stat.count}
+                for stat in snap.statistics(key_type)[:limit]
+            ],
+        }
+        with self._lock:
+            if self._last is not None:
+                result["growth"] = [
+                    {"where": str(stat.traceback), "size_diff_bytes": stat.size_diff, "count_diff": stat.count_diff}
+                    for stat in snap.compare_to(self._last, key_type)[:limit]
+                ]
+            self._last = snap
+        return result
+
+
+def deep_sizeof(obj, seen=None) -> int:
+    """Approximate retained size of a container of dicts/lists/tuples/strings."""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(v, seen) for v in obj)
+    elif hasattr(obj, "__slots__"):
+        size += sum(deep_sizeof(getattr(obj, s), seen) for s in obj.__slots__ if hasattr(obj, s))
+    return size
@@ -0,0 +1,248 @@
+"""Latency-aware routing of Vertex AI generation across regions.
+
+The router keeps one genai client per configured location and tracks, for each
+region, a moving average of time-to-first-chunk plus recent errors. Every call
+goes to the fastest healthy region that is allowed to reach the RAG corpus in
+the request. An average that hasn't been refreshed for ``stale_seconds`` counts
+as unmeasured again, so a region that was slow once is re-probed instead of
+being ranked on old numbers forever. If a region fails with a transport, 5xx
+or 429 error before it produces its first chunk, the call fails over to the
+next candidate and the failed region is put on a short cooldown. Request errors
+(400 InvalidArgument and other 4xx) are raised as-is: every region would reject
+the same request, and it says nothing about the region's health.
+
+Clients are created through ``client_factory(location)``, so tests can pass
+fake clients whose ``models.generate_content_stream`` sleeps for a per-region
+latency or raises.
+"""
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set
+
+try:
+    import httpx
+
+    _TRANSPORT_ERRORS = (ConnectionError, TimeoutError, httpx.TransportError)
+except Exception:
+    _TRANSPORT_ERRORS = (ConnectionError, TimeoutError)
+
+
+def corpora_in_config(config) -> Set[str]:
+    """Return the RAG corpus names referenced by a GenerateContentConfig's retrieval tools."""
+    corpora: Set[str] = set()
+    for tool in getattr(config, "tools", None) or []:
+        retrieval = getattr(tool, "retrieval", None)
+        store = getattr(retrieval, "vertex_rag_store", None) if retrieval else None
+        for resource in getattr(store, "rag_resources", None) or []:
+            name = getattr(resource, "rag_corpus", None)
+            if name:
+                corpora.add(name)
+    return corpora
+
+
+def corpus_region(corpus: str) -> Optional[str]:
+    """Region segment of a corpus resource name (projects/p/locations/<region>/ragCorpora/id), if any."""
+    parts = corpus.split("/")
+    for i, part in enumerate(parts[:-1]):
+        if part == "locations":
+            return parts[i + 1] or None
+    return None
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """Whether an error points at the region (transport, 5xx, 429) rather than the request."""
+    # google.genai APIError and google.api_core exceptions carry the HTTP status as .code
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code >= 500 or code in (408, 429)
+    return isinstance(error, _TRANSPORT_ERRORS)
+
+
+class RegionStats:
+    """Rolling health and latency numbers for one region."""
+
+    __slots__ = ("ttfc_ewma", "samples", "last_sample", "errors", "consecutive_errors", "cooldown_until", "in_flight")
+
+    def __init__(self):
+        self.ttfc_ewma: Optional[float] = None
+        self.samples = 0
+        self.last_sample = 0.0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.cooldown_until = 0.0
+        self.in_flight = 0
+
+    def as_dict(self, now: float) -> dict:
+        return {
+            "ttfc_ms": round(self.ttfc_ewma * 1000, 1) if self.ttfc_ewma is not None else None,
+            "samples": self.samples,
+            "errors": self.errors,
+            "consecutive_errors": self.consecutive_errors,
+            "cooling_down": self.cooldown_until > now,
+            "in_flight": self.in_flight,
+        }
+
+
+class RegionRouter:
+    """Pick the best healthy region for each generation call and fail over on errors."""
+
+    def __init__(
+        self,
+        locations: Iterable[str],
+        client_factory: Callable[[str], object],
+        corpus_access: Optional[Dict[str, Iterable[str]]] = None,
+        alpha: float = 0.3,
+        cooldown_seconds: float = 30.0,
+        max_cooldown_seconds: float = 300.0,
+        stale_seconds: float = 120.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.locations: List[str] = [loc for loc in dict.fromkeys(l.strip() for l in locations) if loc]
+        if not self.locations:
+            raise ValueError("RegionRouter needs at least one location")
+        self._client_factory = client_factory
+        # corpus name -> regions whose models may query it. Corpora not listed are reachable from
+        # their own region and from the primary (first) location; see eligible()
+        self._corpus_access = {k: set(v) for k, v in (corpus_access or {}).items()}
+        self._alpha = alpha
+        self._cooldown = cooldown_seconds
+        self._max_cooldown = max_cooldown_seconds
+        self._stale = stale_seconds
+        self._clock = clock
+        self._clients: Dict[str, object] = {}
+        self._stats: Dict[str, RegionStats] = {loc: RegionStats() for loc in self.locations}
+        self._lock = threading.Lock()
+
+    def set_corpus_access(self, corpus: str, locations: Iterable[str]) -> None:
+        """Restrict which regions may serve requests that retrieve from `corpus`."""
+        with self._lock:
+            self._corpus_access[corpus] = set(locations)
+
+    def client(self, location: str):
+        """Return (creating on first use) the client for a location."""
+        with self._lock:
+            client = self._clients.get(location)
+        if client is not None:
+            return client
+        client = self._client_factory(location)
+        with self._lock:
+            return self._clients.setdefault(location, client)
+
+    def eligible(self, corpora: Iterable[str] = ()) -> List[str]:
+        """Regions allowed to serve a request touching the given corpora, in configured order.
+
+        Without an explicit set_corpus_access entry, a corpus is assumed reachable only
+        from its own region (from the resource name) and from the primary location,
+        which the deployment was already set up to use it from. A corpus name with no
+        region segment is reachable everywhere.
+        """
+        allowed = list(self.locations)
+        for corpus in corpora:
+            access = self._corpus_access.get(corpus)
+            if access is None:
+                region = corpus_region(corpus)
+                if region is not None:
+                    access = {region, self.locations[0]}
+            if access is not None:
+                allowed = [loc for loc in allowed if loc in access]
+        return allowed
+
+    def ranked(self, corpora: Iterable[str] = ()) -> List[str]:
+        """Eligible regions ordered best-first.
+
+        Healthy regions come before ones on cooldown. Among healthy regions, ones with
+        no samples yet are tried first so they get measured, as are idle regions whose
+        average has gone stale, then lowest average TTFC (plus a small penalty per
+        in-flight call) wins. Cooling-down regions stay at the end as a last resort
+        rather than being dropped, so a full outage still retries.
+        """
+        now = self._clock()
+        candidates = self.eligible(corpora)
+        with self._lock:
+            def key(loc: str):
+                st = self._stats[loc]
+                cooling = st.cooldown_until > now
+                stale = st.in_flight == 0 and now - st.last_sample > self._stale
+                if st.ttfc_ewma is None or stale:
+                    score = -1.0
+                else:
+                    score = st.ttfc_ewma * (1 + 0.1 * st.in_flight)
+                return (cooling, score, candidates.index(loc))
+            return sorted(candidates, key=key)
+
+    def _record_success(self, location: str, ttfc: float) -> None:
+        now = self._clock()
+        with self._lock:
+            st = self._stats[location]
+            # A stale average is replaced by the fresh sample instead of being blended with it
+            if st.ttfc_ewma is None or now - st.last_sample > self._stale:
+                st.ttfc_ewma = ttfc
+            else:
+                st.ttfc_ewma = (1 - self._alpha) * st.ttfc_ewma + self._alpha * ttfc
+            st.samples += 1
+            st.last_sample = now
+            st.consecutive_errors = 0
+            st.cooldown_until = 0.0
+
+    def _record_error(self, location: str) -> None:
+        with self._lock:
+            st = self._stats[location]
+            st.errors += 1
+            st.consecutive_errors += 1
+            backoff = min(self._max_cooldown, self._cooldown * (2 ** (st.consecutive_errors - 1)))
+            st.cooldown_until = self._clock() + backoff
+
+    def generate_content_stream(self, model: str, contents, config=None, location: Optional[str] = None) -> Iterator:
+        """Drop-in for ``client.models.generate_content_stream`` that routes across regions.
+
+        Failover happens only before the first chunk is yielded, and only for retryable
+        errors (see is_retryable_error). An error after that is raised to the caller,
+        since part of the answer has already been consumed.
+        Passing ``location`` pins the call to that region (e.g. where a context cache
+        lives) with no failover.
+        """
+        corpora = corpora_in_config(config)
+        if location is not None:
+            candidates = [location] if location in self._stats else []
+        else:
+            candidates = self.ranked(corpora)
+        if not candidates:
+            raise RuntimeError(f"No configured region can reach corpora: {', '.join(sorted(corpora))}")
+
+        last_error: Optional[Exception] = None
+        for location in candidates:
+            st = self._stats[location]
+            with self._lock:
+                st.in_flight += 1
+            started = self._clock()
+            first = True
+            try:
+                client = self.client(location)
+                stream = client.models.generate_content_stream(model=model, contents=contents, config=config)
+                for chunk in stream:
+                    if first:
+                        first = False
+                        self._record_success(location, self._clock() - started)
+                    yield chunk
+                if first:
+                    # Empty stream still counts as a completed round trip
+                    self._record_success(location, self._clock() - started)
+                return
+            except Exception as e:
+                if not is_retryable_error(e):
+                    raise
+                self._record_error(location)
+                if not first:
+                    raise
+                last_error = e
+                print(f"Generation failed in {location}, failing over: {e}")
+            finally:
+                with self._lock:
+                    st.in_flight -= 1
+        raise last_error if last_error else RuntimeError("No region available")
+
+    def snapshot(self) -> Dict[str, dict]:
+        """Per-region stats, for logs and diagnostics."""
+        now = self._clock()
+        with self._lock:
+            return {loc: self._stats[loc].as_dict(now) for loc in self.locations}
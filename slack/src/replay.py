@@ -0,0 +1,312 @@
+"""Replay captured Slack traffic against a bot instance and report latency.
+
+Reads files written by traffic capture (SLACK_CAPTURE_PATH, see
+traffic_capture.py), re-signs every request with the current time and the
+signing secret, and POSTs it to /slack/events, preserving the original
+inter-arrival gaps scaled by --speed (0 = as fast as possible).
+
+Without --url, the bot in app.py is started in-process on a local port with
+stubbed clients: Slack Web API calls go to a local fake server, and Vertex
+generation is replaced by a fake that waits --model-latency-ms. In that mode
+the report also includes reply latency (event sent -> chat.postMessage seen).
+
+Usage:
+    python replay.py /tmp/slack-capture.jsonl.gz --speed 1
+    python replay.py capture.jsonl.gz --speed 10 --concurrency 32
+    python replay.py capture.jsonl.gz --speed 0 --url http://localhost:3000/slack/events
+"""
+import argparse
+import glob
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Tuple
+from urllib import request as urlrequest
+from urllib.error import HTTPError
+from urllib.parse import parse_qsl, urlparse
+
+# Headers that must be regenerated for each replayed request
+_DROP_HEADERS = {"host", "content-length", "x-slack-signature", "x-slack-request-timestamp", "connection"}
+
+
+def _open(path: str):
+    if path.endswith(".gz") or ".gz." in path:
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def load_records(paths: List[str]) -> List[dict]:
+    """Load capture records from files (rotated backups included), ordered by arrival time."""
+    files = []
+    for path in paths:
+        # capture.jsonl.gz plus its rotated capture.jsonl.gz.1, .2, ...
+        files.extend(sorted(glob.glob(path + ".*"), reverse=True))
+        files.append(path)
+    records = []
+    for path in files:
+        if not os.path.isfile(path):
+            continue
+        with _open(path) as f:
+            try:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # A crash mid-write can leave a truncated last line
+                        continue
+            except EOFError:
+                # The live capture file has no gzip end marker until it is closed; keep what was read
+                pass
+    records.sort(key=lambda r: r.get("t", 0))
+    return records
+
+
+def sign(secret: str, timestamp: str, body: str) -> str:
+    base = f"v0:{timestamp}:{body}".encode("utf-8")
+    return "v0=" + hmac.new(secret.encode("utf-8"), base, hashlib.sha256).hexdigest()
+
+
+def _thread_key(body: str) -> Optional[Tuple[str, str]]:
+    """(channel, thread_ts) a reply to this event would be posted to, if any."""
+    try:
+        event = (json.loads(body) or {}).get("event") or {}
+    except ValueError:
+        return None
+    channel = event.get("channel")
+    thread_ts = event.get("thread_ts") or event.get("ts")
+    return (channel, thread_ts) if channel and thread_ts else None
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[idx]
+
+
+class FakeSlackAPI:
+    """Minimal local Slack Web API: answers every method with ok and records posted replies."""
+
+    def __init__(self):
+        self.posts: List[Tuple[float, str, str]] = []
+        self.calls: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        outer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _handle(self):
+                parsed = urlparse(self.path)
+                method = parsed.path.rsplit("/", 1)[-1]
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length).decode("utf-8") if length else ""
+                params = dict(parse_qsl(parsed.query))
+                if raw:
+                    try:
+                        params.update(json.loads(raw))
+                    except ValueError:
+                        params.update(parse_qsl(raw))
+                payload = outer.respond(method, params)
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = _handle
+            do_POST = _handle
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/api/"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def respond(self, method: str, params: dict) -> dict:
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        if method == "auth.test":
+            return {"ok": True, "user_id": "UREPLAYBOT", "bot_id": "BREPLAYBOT", "team_id": "TREPLAY", "user": "replay-bot"}
+        if method == "conversations.replies":
+            return {"ok": True, "messages": [], "has_more": False}
+        if method == "chat.postMessage":
+            with self._lock:
+                self.posts.append((time.time(), params.get("channel", ""), params.get("thread_ts", "")))
+            return {"ok": True, "channel": params.get("channel"), "ts": f"{time.time():.6f}"}
+        return {"ok": True}
+
+    def close(self):
+        self.server.shutdown()
+
+
+class FakeRouter:
+    """Stands in for RegionRouter: waits a fixed latency, then streams a canned answer."""
+
+    def __init__(self, latency_ms: float, chunks: int = 4):
+        self.latency = latency_ms / 1000.0
+        self.chunks = chunks
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_content_stream(self, model, contents, config=None, location=None):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        for i in range(self.chunks):
+            text = f"replayed answer part {i + 1}. "
+            yield SimpleNamespace(text=text, candidates=[SimpleNamespace(content=text)])
+
+
+def start_local_app(model_latency_ms: float):
+    """Import app.py with stubbed Slack/Vertex clients and serve it on a local port."""
+    fake_slack = FakeSlackAPI()
+    os.environ.setdefault("SLACK_BOT_TOKEN", "xoxb-replay")
+    os.environ.setdefault("SLACK_SIGNING_SECRET", "replay-secret")
+    # Point the bot's Web API client (including its startup auth.test) at the fake
+    os.environ["SLACK_API_URL"] = fake_slack.url
+    # Never capture the replay itself, and serve /slack/events even if the env selects Socket Mode
+    os.environ["SLACK_CAPTURE_PATH"] = ""
+    os.environ["SLACK_MODE"] = "http"
+    from werkzeug.serving import make_server
+
+    import app
+
+    fake_router = FakeRouter(model_latency_ms)
+    app._region_router = fake_router
+    app._default_route.router = fake_router
+    if app._rag_config is None:
+        app._rag_config = object()
+
+    server = make_server("127.0.0.1", 0, app.flask_app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/slack/events"
+    return url, os.environ["SLACK_SIGNING_SECRET"], fake_slack, server
+
+
+def _send(url: str, secret: str, record: dict) -> Tuple[float, float, int]:
+    body = record.get("body") or ""
+    headers = {k: v for k, v in (record.get("headers") or {}).items() if k.lower() not in _DROP_HEADERS}
+    timestamp = str(int(time.time()))
+    headers["X-Slack-Request-Timestamp"] = timestamp
+    headers["X-Slack-Signature"] = sign(secret, timestamp, body)
+    req = urlrequest.Request(url, data=body.encode("utf-8"), headers=headers, method="POST")
+    started = time.time()
+    try:
+        with urlrequest.urlopen(req, timeout=30) as resp:
+            resp.read()
+            status = resp.status
+    except HTTPError as e:
+        status = e.code
+    except Exception:
+        status = 0
+    return started, time.time() - started, status
+
+
+def replay(records: List[dict], url: str, secret: str, speed: float = 1.0, concurrency: int = 16):
+    """Send records preserving their relative timing divided by speed (0 = no waiting)."""
+    results: List[Tuple[dict, float, float, int]] = []
+    lock = threading.Lock()
+
+    def run(record):
+        started, latency, status = _send(url, secret, record)
+        with lock:
+            results.append((record, started, latency, status))
+
+    t0 = records[0].get("t", 0) if records else 0
+    wall0 = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for record in records:
+            if speed > 0:
+                delay = (record.get("t", t0) - t0) / speed - (time.time() - wall0)
+                if delay > 0:
+                    time.sleep(delay)
+            pool.submit(run, record)
+    return results, time.time() - wall0
+
+
+def report(results, elapsed: float, fake_slack: Optional[FakeSlackAPI] = None) -> dict:
+    latencies = [r[2] * 1000 for r in results]
+    statuses: Dict[str, int] = {}
+    for r in results:
+        statuses[str(r[3])] = statuses.get(str(r[3]), 0) + 1
+    summary = {
+        "requests": len(results),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(results) / elapsed, 2) if elapsed > 0 else 0.0,
+        "ack_ms": {
+            "p50": round(_percentile(latencies, 50), 1),
+            "p95": round(_percentile(latencies, 95), 1),
+            "p99": round(_percentile(latencies, 99), 1),
+            "max": round(max(latencies), 1) if latencies else 0.0,
+        },
+        "status": statuses,
+    }
+    if fake_slack is not None:
+        # Match each reply to the earliest unmatched event sent to the same thread
+        sent: Dict[Tuple[str, str], List[float]] = {}
+        for record, started, _latency, _status in sorted(results, key=lambda r: r[1]):
+            key = _thread_key(record.get("body") or "")
+            if key:
+                sent.setdefault(key, []).append(started)
+        reply_ms = []
+        for posted_at, channel, thread_ts in sorted(fake_slack.posts):
+            pending = sent.get((channel, thread_ts))
+            if pending:
+                reply_ms.append((posted_at - pending.pop(0)) * 1000)
+        summary["replies"] = len(reply_ms)
+        summary["reply_ms"] = {
+            "p50": round(_percentile(reply_ms, 50), 1),
+            "p95": round(_percentile(reply_ms, 95), 1),
+            "p99": round(_percentile(reply_ms, 99), 1),
+        }
+        summary["slack_api_calls"] = dict(fake_slack.calls)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured Slack events")
+    parser.add_argument("paths", nargs="+", help="capture files (rotated .1, .2 ... are picked up automatically)")
+    parser.add_argument("--url", help="target /slack/events URL; omit to run app.py in-process with stubs")
+    parser.add_argument("--secret", default=os.getenv("SLACK_SIGNING_SECRET"), help="signing secret of the target")
+    parser.add_argument("--speed", type=float, default=1.0, help="time scale: 1 = real time, N = N times faster, 0 = as fast as possible")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--limit", type=int, default=0, help="replay only the first N records")
+    parser.add_argument("--model-latency-ms", type=float, default=800.0, help="fake Vertex latency for in-process runs")
+    parser.add_argument("--drain-seconds", type=float, default=5.0, help="in-process: wait this long for replies after the last send")
+    args = parser.parse_args()
+
+    records = load_records(args.paths)
+    if args.limit:
+        records = records[: args.limit]
+    if not records:
+        raise SystemExit("No records found")
+
+    fake_slack = None
+    if args.url:
+        url, secret = args.url, args.secret
+        if not secret:
+            raise SystemExit("--secret (or SLACK_SIGNING_SECRET) is required with --url")
+    else:
+        url, secret, fake_slack, _server = start_local_app(args.model_latency_ms)
+
+    print(f"Replaying {len(records)} requests to {url} at speed {args.speed or 'max'}")
+    results, elapsed = replay(records, url, secret, args.speed, args.concurrency)
+    if fake_slack is not None:
+        time.sleep(args.drain_seconds)
+    print(json.dumps(report(results, elapsed, fake_slack), indent=2))
+
+
+if __name__ == "__main__":
+    main()
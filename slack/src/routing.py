@@ -0,0 +1,201 @@
+"""Per-channel / per-workspace routing to a corpus, model and generation settings.
+
+Routes come from a JSON file (ROUTES_FILE):
+
+    {
+      "default": {"model": "gemini-2.5-flash"},
+      "teams":    {"T0123": {"corpus": "projects/.../ragCorpora/111"}},
+      "channels": {"C0456": {"corpus": "projects/.../ragCorpora/222",
+                             "corpus_version": "2024-06-01",
+                             "model": "gemini-2.5-pro",
+                             "profile_models": {"chat": "gemini-2.5-flash", "quick": "gemini-2.5-flash"},
+                             "generation": {"temperature": 0.3, "max_output_tokens": 4096},
+                             "locations": ["us-central1"]}}
+    }
+
+A channel entry wins over a team entry, which wins over "default". Missing fields
+fall back to the deployment's env settings. ``model`` applies to every
+generation profile unless ``profile_models`` names one for that profile.
+``generation`` accepts only the keys in GENERATION_KEYS, with numeric values.
+A file with unknown keys or profile names, or values of the wrong type (say a
+string for ``locations``), is rejected and the previous table keeps serving. The file is re-read when its mtime
+changes (checked at most every ``reload_seconds``), so routes change without a
+restart.
+
+Objects built for a route (clients, configs) are memoized by the route's
+resolved spec. Resolving a request is dictionary lookups, and a reload only
+builds routes whose spec actually changed.
+"""
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+ROUTE_FIELDS = (
+    "corpus", "corpus_version", "model", "profile_models", "project", "locations", "corpus_locations", "generation",
+)
+GENERATION_KEYS = ("temperature", "top_p", "max_output_tokens")
+STRING_FIELDS = ("corpus", "corpus_version", "model", "project")
+LIST_FIELDS = ("locations", "corpus_locations")
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _check_spec(name: str, spec: dict) -> None:
+    """Raise ValueError if a route spec's values have the wrong types."""
+    if not isinstance(spec, dict):
+        raise ValueError(f"{name}: route must be an object, got {type(spec).__name__}")
+    for field in STRING_FIELDS:
+        if spec.get(field) is not None and not isinstance(spec[field], str):
+            raise ValueError(f"{name}: {field} must be a string")
+    for field in LIST_FIELDS:
+        value = spec.get(field)
+        if value is not None and not (isinstance(value, list) and all(isinstance(v, str) for v in value)):
+            raise ValueError(f"{name}: {field} must be a list of strings")
+    profile_models = spec.get("profile_models")
+    if profile_models is not None and not (
+        isinstance(profile_models, dict) and all(isinstance(v, str) for v in profile_models.values())
+    ):
+        raise ValueError(f"{name}: profile_models must map profile names to model strings")
+    generation = spec.get("generation")
+    if generation is None:
+        return
+    if not isinstance(generation, dict):
+        raise ValueError(f"{name}: generation must be an object")
+    for key, value in generation.items():
+        if key == "max_output_tokens":
+            if not (isinstance(value, int) and not isinstance(value, bool) and value > 0):
+                raise ValueError(f"{name}: generation.max_output_tokens must be a positive integer")
+        elif not (_is_number(value) and value >= 0):
+            raise ValueError(f"{name}: generation.{key} must be a non-negative number")
+
+
+class Route:
+    """Resolved routing target; ``key`` identifies identical specs across reloads."""
+
+    __slots__ = ("name",) + ROUTE_FIELDS + ("key",)
+
+    def __init__(self, name: str, spec: dict, profiles: Sequence[str] = ()):
+        _check_spec(name, spec)
+        self.name = name
+        self.corpus = spec.get("corpus")
+        # Tags cached answers; bump it when the corpus content changes
+        self.corpus_version = spec.get("corpus_version")
+        self.model = spec.get("model")
+        self.profile_models = dict(spec.get("profile_models") or {})
+        self.project = spec.get("project")
+        self.locations = tuple(spec.get("locations") or ())
+        self.corpus_locations = tuple(spec.get("corpus_locations") or ())
+        self.generation = dict(spec.get("generation") or {})
+        unknown = sorted(set(self.generation) - set(GENERATION_KEYS))
+        if unknown:
+            raise ValueError(f"{name}: unsupported generation settings {unknown}; allowed: {list(GENERATION_KEYS)}")
+        unknown = sorted(set(self.profile_models) - set(profiles)) if profiles else []
+        if unknown:
+            raise ValueError(f"{name}: unknown profiles in profile_models {unknown}; known: {list(profiles)}")
+        self.key = json.dumps({f: spec.get(f) for f in ROUTE_FIELDS}, sort_keys=True)
+
+
+class RouteTable:
+    def __init__(
+        self,
+        path: str,
+        builder: Callable[[Route], object],
+        reload_seconds: float = 10.0,
+        profiles: Sequence[str] = (),
+    ):
+        self.path = path
+        self._builder = builder
+        self.reload_seconds = reload_seconds
+        # Profile names profile_models may refer to (empty = not checked)
+        self.profiles = tuple(profiles)
+        self._default = Route("default", {})
+        self._teams: Dict[str, Route] = {}
+        self._channels: Dict[str, Route] = {}
+        self._built: Dict[str, object] = {}
+        self._mtime: Optional[float] = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self.reloads = 0
+        if path:
+            self._reload()
+
+    def _reload(self) -> None:
+        try:
+            mtime = os.path.getmtime(self.path)
+            if mtime == self._mtime:
+                return
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            print(f"Routes file not found: {self.path}; using default route")
+            return
+        except Exception as e:
+            # Keep serving the previous table if the new file is broken
+            print(f"Failed to load routes from {self.path}: {e}")
+            return
+
+        def merged(name: str, spec: dict) -> Route:
+            if not isinstance(spec or {}, dict):
+                raise ValueError(f"{name}: route must be an object, got {type(spec).__name__}")
+            return Route(name, {**default_spec, **(spec or {})}, self.profiles)
+
+        try:
+            if not isinstance(data, dict):
+                raise ValueError("routes file must be a JSON object")
+            default_spec = data.get("default") or {}
+            default = Route("default", default_spec, self.profiles)
+            teams = {k: merged(f"team:{k}", v) for k, v in (data.get("teams") or {}).items()}
+            channels = {k: merged(f"channel:{k}", v) for k, v in (data.get("channels") or {}).items()}
+        except (ValueError, TypeError, AttributeError) as e:
+            print(f"Invalid routes in {self.path}, keeping the previous table: {e}")
+            return
+        live_keys = {r.key for r in [default, *teams.values(), *channels.values()]}
+        with self._lock:
+            self._default, self._teams, self._channels = default, teams, channels
+            self._mtime = mtime
+            # Drop built objects for specs no longer referenced; unchanged specs keep theirs
+            self._built = {k: v for k, v in self._built.items() if k in live_keys}
+            self.reloads += 1
+        print(f"Loaded {len(channels)} channel and {len(teams)} team routes from {self.path}")
+
+    def maybe_reload(self) -> None:
+        if not self.path:
+            return
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.reload_seconds
+        self._reload()
+
+    def resolve(self, channel: Optional[str] = None, team: Optional[str] = None) -> Route:
+        self.maybe_reload()
+        if channel and channel in self._channels:
+            return self._channels[channel]
+        if team and team in self._teams:
+            return self._teams[team]
+        return self._default
+
+    def built(self, channel: Optional[str] = None, team: Optional[str] = None) -> Tuple[Route, object]:
+        """Resolve a route and return it with its memoized built objects."""
+        route = self.resolve(channel, team)
+        built = self._built.get(route.key)
+        if built is None:
+            with self._lock:
+                built = self._built.get(route.key)
+                if built is None:
+                    built = self._built[route.key] = self._builder(route)
+        return route, built
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "path": self.path,
+                "channels": sorted(self._channels),
+                "teams": sorted(self._teams),
+                "built": len(self._built),
+                "reloads": self.reloads,
+            }
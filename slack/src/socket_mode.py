@@ -0,0 +1,172 @@
+"""Socket Mode runner: serve the Bolt listeners over one websocket.
+
+This replaces the public /slack/events endpoint with a single outbound websocket
+(SLACK_MODE=socket, needs an app-level SLACK_APP_TOKEN). Event envelopes are
+acked as soon as they have a worker slot. They then run on a bounded worker pool,
+so a slow model call never holds up the connection or the 3s ack deadline.
+
+Backpressure: when every worker is busy and the queue is full, the envelope is
+left unacked (after waiting up to ``ack_wait`` seconds for a slot). Slack then
+redelivers it later instead of us buffering without limit.
+
+The connection is supervised here rather than by the SDK's auto-reconnect.
+Dropped connections are reopened with exponential backoff and jitter.
+Every reconnect asks apps.connections.open for a fresh URL. ``client_factory``
+can return a client pointed at a local fake Socket Mode server; see
+socket_mode_check.py, which checks acks, shedding and reconnects that way.
+"""
+import json
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from slack_bolt.request import BoltRequest
+from slack_sdk.socket_mode.builtin import SocketModeClient
+from slack_sdk.socket_mode.request import SocketModeRequest
+from slack_sdk.socket_mode.response import SocketModeResponse
+
+
+class SocketModeRunner:
+    def __init__(
+        self,
+        app,
+        app_token: str,
+        workers: int = 8,
+        queue_size: int = 32,
+        ack_wait: float = 2.0,
+        drop_reason: Optional[Callable[[dict, dict], Optional[str]]] = None,
+        client_factory: Optional[Callable[[], SocketModeClient]] = None,
+        check_interval: float = 5.0,
+        initial_backoff: float = 1.0,
+        max_backoff: float = 60.0,
+    ):
+        self.app = app
+        self.app_token = app_token
+        self.ack_wait = ack_wait
+        self._drop_reason = drop_reason
+        self._client_factory = client_factory or self._default_client
+        self.check_interval = check_interval
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="socket-worker")
+        # Running + queued envelopes; acquiring a slot is what allows an ack
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._client: Optional[SocketModeClient] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {
+            "received": 0, "dispatched": 0, "dropped": 0, "shed": 0, "errors": 0,
+            "connects": 0, "connect_errors": 0,
+        }
+
+    def _default_client(self) -> SocketModeClient:
+        return SocketModeClient(
+            app_token=self.app_token,
+            web_client=self.app.client,
+            auto_reconnect_enabled=False,
+        )
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def _ack(self, client, req: SocketModeRequest, payload: Optional[dict] = None) -> None:
+        client.send_socket_mode_response(SocketModeResponse(envelope_id=req.envelope_id, payload=payload))
+
+    def _on_request(self, client, req: SocketModeRequest) -> None:
+        self._count("received")
+        if req.type != "events_api":
+            # Slash commands / interactivity can carry a response in the ack, so run them inline
+            self._dispatch_inline(client, req)
+            return
+
+        if self._drop_reason is not None:
+            headers = {}
+            if req.retry_attempt:
+                headers = {"X-Slack-Retry-Num": str(req.retry_attempt), "X-Slack-Retry-Reason": req.retry_reason or ""}
+            reason = self._drop_reason(req.payload or {}, headers)
+            if reason:
+                self._count("dropped")
+                self._ack(client, req)
+                return
+
+        if not self._slots.acquire(timeout=self.ack_wait):
+            # Saturated: leave it unacked so Slack redelivers later
+            self._count("shed")
+            return
+        try:
+            self._ack(client, req)
+        except Exception as e:
+            # Connection went away before the ack; Slack will redeliver the envelope
+            self._slots.release()
+            self._count("errors")
+            print(f"Socket Mode ack failed for {req.envelope_id}: {e}")
+            return
+        try:
+            self._pool.submit(self._run, req.payload)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _run(self, payload: dict) -> None:
+        try:
+            self.app.dispatch(BoltRequest(mode="socket_mode", body=payload))
+            self._count("dispatched")
+        except Exception as e:
+            self._count("errors")
+            print(f"Socket Mode dispatch failed: {e}")
+        finally:
+            self._slots.release()
+
+    def _dispatch_inline(self, client, req: SocketModeRequest) -> None:
+        bolt_resp = self.app.dispatch(BoltRequest(mode="socket_mode", body=req.payload))
+        if bolt_resp.status != 200:
+            self._count("errors")
+            return
+        body = bolt_resp.body
+        if not body:
+            self._ack(client, req)
+            return
+        content_type = (bolt_resp.headers.get("content-type") or [""])[0]
+        payload = json.loads(body) if content_type.startswith("application/json") else {"text": body}
+        self._ack(client, req, payload)
+
+    def run_forever(self) -> None:
+        """Connect and keep the connection alive until stop() is called."""
+        backoff = self.initial_backoff
+        while not self._stop.is_set():
+            try:
+                if self._client is None:
+                    self._client = self._client_factory()
+                    self._client.socket_mode_request_listeners.append(self._on_request)
+                if not self._client.is_connected():
+                    # A fresh URL every time; an old one may have been the one that dropped
+                    self._client.connect_to_new_endpoint(force=True)
+                    if not self._client.is_connected():
+                        raise ConnectionError("websocket handshake failed")
+                    self._count("connects")
+                    print("Socket Mode connected")
+                backoff = self.initial_backoff
+                self._stop.wait(self.check_interval)
+            except Exception as e:
+                self._count("connect_errors")
+                delay = backoff + random.uniform(0, backoff / 2)
+                print(f"Socket Mode connection failed, retrying in {delay:.1f}s: {e}")
+                self._stop.wait(delay)
+                backoff = min(backoff * 2, self.max_backoff)
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.run_forever, name="socket-mode", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._client is not None:
+            self._client.close()
+        self._pool.shutdown(wait=True)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.stats)
@@ -0,0 +1,347 @@
+"""Check SocketModeRunner against a local fake Socket Mode server.
+
+Starts a fake Slack backend on localhost: the Web API from replay.py plus
+apps.connections.open, and a minimal websocket server that pushes event
+envelopes and records acks. A SocketModeRunner wraps a small Bolt app whose
+app_mention listener blocks until released, which stands in for a slow model
+call. The checks:
+
+  ack        an envelope is acked as soon as it has a worker slot, before the
+             listener finishes
+  shedding   with every worker and queue slot taken, envelopes stay unacked
+             (counted as shed) and are accepted once Slack redelivers them
+             after the pool drains
+  reconnect  a dropped connection, and apps.connections.open failures, are
+             retried with backoff onto a fresh URL, and events flow again
+
+Usage:
+    python socket_mode_check.py            # run every check
+    python socket_mode_check.py shedding   # run one
+"""
+import argparse
+import base64
+import hashlib
+import json
+import socket
+import struct
+import sys
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from replay import FakeSlackAPI
+
+_WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+_OP_TEXT, _OP_CLOSE, _OP_PING, _OP_PONG = 0x1, 0x8, 0x9, 0xA
+
+
+def _recv_exact(sock: socket.socket, n: int) -> bytes:
+    data = b""
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        data += chunk
+    return data
+
+
+def _frame(opcode: int, payload: bytes) -> bytes:
+    """Server-to-client frame (unmasked, FIN set)."""
+    n = len(payload)
+    if n < 126:
+        header = struct.pack("!BB", 0x80 | opcode, n)
+    elif n < 65536:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, n)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, n)
+    return header + payload
+
+
+def _read_frame(sock: socket.socket):
+    b0, b1 = _recv_exact(sock, 2)
+    n = b1 & 0x7F
+    if n == 126:
+        n = struct.unpack("!H", _recv_exact(sock, 2))[0]
+    elif n == 127:
+        n = struct.unpack("!Q", _recv_exact(sock, 8))[0]
+    mask = _recv_exact(sock, 4) if b1 & 0x80 else b""
+    payload = _recv_exact(sock, n)
+    if mask:
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return b0 & 0x0F, payload
+
+
+class FakeSocketModeServer(FakeSlackAPI):
+    """Fake Slack: Web API (see replay.FakeSlackAPI) plus a websocket endpoint for Socket Mode."""
+
+    def __init__(self):
+        super().__init__()
+        self.acks: Dict[str, float] = {}
+        self.connections_opened = 0
+        # Make the next N apps.connections.open calls fail
+        self.open_failures = 0
+        self._conns: List[socket.socket] = []
+        self._send_lock = threading.Lock()
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind(("127.0.0.1", 0))
+        self._listener.listen(16)
+        self.ws_port = self._listener.getsockname()[1]
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def respond(self, method: str, params: dict) -> dict:
+        if method == "apps.connections.open":
+            with self._lock:
+                self.calls[method] = self.calls.get(method, 0) + 1
+                if self.open_failures > 0:
+                    self.open_failures -= 1
+                    return {"ok": False, "error": "internal_error"}
+            # A distinct URL per call, like Slack's single-use tickets
+            return {"ok": True, "url": f"ws://127.0.0.1:{self.ws_port}/link/?ticket={uuid.uuid4().hex}"}
+        return super().respond(method, params)
+
+    def _accept_loop(self) -> None:
+        while True:
+            try:
+                conn, _addr = self._listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn: socket.socket) -> None:
+        try:
+            request = b""
+            while b"\r\n\r\n" not in request:
+                chunk = conn.recv(4096)
+                if not chunk:
+                    return
+                request += chunk
+            headers = {}
+            for line in request.decode("utf-8").split("\r\n")[1:]:
+                if ":" in line:
+                    k, v = line.split(":", 1)
+                    headers[k.strip().lower()] = v.strip()
+            accept = base64.b64encode(
+                hashlib.sha1((headers["sec-websocket-key"] + _WS_GUID).encode("ascii")).digest()
+            ).decode("ascii")
+            conn.sendall(
+                (
+                    "HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                    f"Sec-WebSocket-Accept: {accept}\r\n\r\n"
+                ).encode("ascii")
+            )
+            with self._lock:
+                self._conns.append(conn)
+                self.connections_opened += 1
+            self._send(conn, {"type": "hello", "num_connections": 1})
+            while True:
+                opcode, payload = _read_frame(conn)
+                if opcode == _OP_PING:
+                    with self._send_lock:
+                        conn.sendall(_frame(_OP_PONG, payload))
+                elif opcode == _OP_CLOSE:
+                    return
+                elif opcode == _OP_TEXT:
+                    message = json.loads(payload.decode("utf-8"))
+                    if message.get("envelope_id"):
+                        with self._lock:
+                            self.acks.setdefault(message["envelope_id"], time.time())
+        except (OSError, ConnectionError, ValueError, KeyError):
+            pass
+        finally:
+            with self._lock:
+                if conn in self._conns:
+                    self._conns.remove(conn)
+            conn.close()
+
+    def _send(self, conn: socket.socket, message: dict) -> None:
+        with self._send_lock:
+            conn.sendall(_frame(_OP_TEXT, json.dumps(message).encode("utf-8")))
+
+    @property
+    def connected(self) -> int:
+        with self._lock:
+            return len(self._conns)
+
+    def send_event(self, event: dict, envelope_id: Optional[str] = None, retry_attempt: int = 0) -> str:
+        """Push an events_api envelope on the newest connection; returns its envelope_id."""
+        envelope_id = envelope_id or uuid.uuid4().hex
+        with self._lock:
+            conn = self._conns[-1]
+        self._send(conn, {
+            "type": "events_api",
+            "envelope_id": envelope_id,
+            "accepts_response_payload": False,
+            "retry_attempt": retry_attempt,
+            "retry_reason": "timeout" if retry_attempt else "",
+            "payload": {
+                "type": "event_callback",
+                "team_id": "TCHECK",
+                "api_app_id": "ACHECK",
+                "event_id": f"Ev{envelope_id[:10]}",
+                "event": event,
+            },
+        })
+        return envelope_id
+
+    def drop_connections(self) -> None:
+        """Close every websocket abruptly, as a network drop would."""
+        with self._lock:
+            conns, self._conns = list(self._conns), []
+        for conn in conns:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            conn.close()
+
+    def close(self) -> None:
+        self.drop_connections()
+        self._listener.close()
+        super().close()
+
+
+def _wait_for(predicate: Callable[[], bool], timeout: float = 5.0) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return predicate()
+
+
+def _mention(text: str = "<@UREPLAYBOT> hello") -> dict:
+    ts = f"{time.time():.6f}"
+    return {"type": "app_mention", "user": "UCHECK", "text": text, "ts": ts, "channel": "CCHECK", "event_ts": ts}
+
+
+class Harness:
+    """Fake server + Bolt app with a blocking app_mention listener + SocketModeRunner."""
+
+    def __init__(self, workers: int, queue_size: int, ack_wait: float = 0.2, **runner_kwargs):
+        from slack_bolt import App
+        from slack_sdk import WebClient
+        from slack_sdk.socket_mode.builtin import SocketModeClient
+
+        from socket_mode import SocketModeRunner
+
+        self.server = FakeSocketModeServer()
+        self.release = threading.Event()
+        self.handled: List[float] = []
+        self._lock = threading.Lock()
+        web_client = WebClient(token="xoxb-check", base_url=self.server.url)
+        self.app = App(client=web_client, signing_secret="unused", process_before_response=True)
+
+        @self.app.event("app_mention")
+        def on_mention(body):
+            self.release.wait(10)
+            with self._lock:
+                self.handled.append(time.time())
+
+        self.runner = SocketModeRunner(
+            self.app,
+            "xapp-check",
+            workers=workers,
+            queue_size=queue_size,
+            ack_wait=ack_wait,
+            client_factory=lambda: SocketModeClient(
+                app_token="xapp-check", web_client=web_client, auto_reconnect_enabled=False, ping_interval=1,
+            ),
+            **runner_kwargs,
+        )
+
+    def start(self) -> "Harness":
+        self.runner.start()
+        if not _wait_for(lambda: self.server.connected == 1):
+            raise AssertionError("runner never connected")
+        return self
+
+    def close(self) -> None:
+        self.release.set()
+        self.runner.stop()
+        self.server.close()
+
+
+def check_ack() -> None:
+    h = Harness(workers=2, queue_size=2).start()
+    try:
+        sent = time.time()
+        envelope_id = h.server.send_event(_mention())
+        assert _wait_for(lambda: envelope_id in h.server.acks, 2.0), "envelope was never acked"
+        ack_s = h.server.acks[envelope_id] - sent
+        assert not h.handled, "ack waited for the listener to finish"
+        h.release.set()
+        assert _wait_for(lambda: len(h.handled) == 1), "listener did not run"
+        assert _wait_for(lambda: h.runner.snapshot()["dispatched"] == 1)
+        print(f"  acked in {ack_s * 1000:.1f} ms, before the listener finished")
+    finally:
+        h.close()
+
+
+def check_shedding() -> None:
+    workers, queue_size, extra = 2, 2, 3
+    h = Harness(workers=workers, queue_size=queue_size, ack_wait=0.2).start()
+    try:
+        ids = [h.server.send_event(_mention(f"<@UREPLAYBOT> q{i}")) for i in range(workers + queue_size + extra)]
+        assert _wait_for(lambda: h.runner.snapshot()["shed"] == extra, 3.0), f"expected {extra} shed, got {h.runner.snapshot()}"
+        acked = [e for e in ids if e in h.server.acks]
+        assert len(acked) == workers + queue_size, f"expected {workers + queue_size} acks, got {len(acked)}"
+        shed = [e for e in ids if e not in h.server.acks]
+
+        # Pool drains, then Slack redelivers the unacked envelopes
+        h.release.set()
+        assert _wait_for(lambda: len(h.handled) == workers + queue_size), "accepted envelopes were not handled"
+        for envelope_id in shed:
+            h.server.send_event(_mention(), envelope_id=envelope_id, retry_attempt=1)
+        assert _wait_for(lambda: all(e in h.server.acks for e in shed)), "redelivered envelopes were not acked"
+        assert _wait_for(lambda: len(h.handled) == len(ids)), "redelivered envelopes were not handled"
+        print(f"  {len(acked)} acked, {len(shed)} left unacked while saturated, all handled after redelivery")
+    finally:
+        h.close()
+
+
+def check_reconnect() -> None:
+    h = Harness(workers=2, queue_size=2, check_interval=0.1, initial_backoff=0.1, max_backoff=0.4).start()
+    h.release.set()
+    try:
+        h.server.open_failures = 2
+        h.server.drop_connections()
+        assert _wait_for(lambda: h.server.connected == 1 and h.server.connections_opened == 2, 10.0), "did not reconnect"
+        stats = h.runner.snapshot()
+        assert stats["connects"] == 2, stats
+        assert stats["connect_errors"] >= 2, f"apps.connections.open failures were not retried: {stats}"
+        assert h.server.calls.get("apps.connections.open", 0) >= 4, "reconnect reused an old URL"
+        envelope_id = h.server.send_event(_mention())
+        assert _wait_for(lambda: envelope_id in h.server.acks), "no acks after reconnect"
+        assert _wait_for(lambda: len(h.handled) == 1), "listener did not run after reconnect"
+        print(f"  reconnected after {stats['connect_errors']} failed attempts; events flow again")
+    finally:
+        h.close()
+
+
+CHECKS = {"ack": check_ack, "shedding": check_shedding, "reconnect": check_reconnect}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check SocketModeRunner against a local fake Socket Mode server")
+    parser.add_argument("checks", nargs="*", help=f"checks to run: {', '.join(CHECKS)} (default: all)")
+    args = parser.parse_args()
+    unknown = [name for name in args.checks if name not in CHECKS]
+    if unknown:
+        parser.error(f"unknown checks: {', '.join(unknown)}")
+
+    failed = 0
+    for name in args.checks or list(CHECKS):
+        print(f"{name}:")
+        try:
+            CHECKS[name]()
+            print("  ok")
+        except AssertionError as e:
+            failed += 1
+            print(f"  FAILED: {e}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
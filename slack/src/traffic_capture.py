@@ -0,0 +1,119 @@
+"""Opt-in capture of raw Slack event traffic for later replay.
+
+Each request to /slack/events is written as one JSON line to a gzip-compressed
+file: arrival time, headers and the raw body. Secrets are redacted before
+anything touches disk. Files rotate once they reach a size limit, and only the
+newest few are kept. See replay.py for the matching replay tool.
+"""
+import gzip
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional, TextIO
+from urllib.parse import parse_qsl, urlencode
+
+REDACTED = "[redacted]"
+# Headers that carry credentials; the signature is recomputed on replay anyway
+_SECRET_HEADERS = {"authorization", "cookie", "x-slack-signature", "proxy-authorization"}
+# Body fields that carry credentials (legacy verification token, enterprise tokens)
+_SECRET_FIELDS = {"token", "bot_access_token", "access_token"}
+
+
+def _redact_json(value):
+    if isinstance(value, dict):
+        return {k: (REDACTED if k in _SECRET_FIELDS else _redact_json(v)) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_redact_json(v) for v in value]
+    return value
+
+
+def redact_body(body: str, content_type: str = "") -> str:
+    """Strip tokens from a JSON or form-encoded Slack request body."""
+    if not body:
+        return body
+    if "application/x-www-form-urlencoded" in content_type:
+        pairs = parse_qsl(body, keep_blank_values=True)
+        redacted = []
+        for k, v in pairs:
+            if k in _SECRET_FIELDS:
+                v = REDACTED
+            elif k == "payload":
+                try:
+                    v = json.dumps(_redact_json(json.loads(v)), ensure_ascii=False)
+                except ValueError:
+                    pass
+            redacted.append((k, v))
+        return urlencode(redacted)
+    try:
+        return json.dumps(_redact_json(json.loads(body)), ensure_ascii=False)
+    except ValueError:
+        return body
+
+
+def redact_headers(headers: Dict[str, str]) -> Dict[str, str]:
+    return {k: (REDACTED if k.lower() in _SECRET_HEADERS else v) for k, v in headers.items()}
+
+
+class TrafficCapture:
+    """Append redacted request records to a rotating .jsonl.gz file."""
+
+    def __init__(self, path: str, max_bytes: int = 50 * 1024 * 1024, backups: int = 5):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.records = 0
+        self._written = 0
+        self._file: Optional[TextIO] = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = gzip.open(self.path, "at", encoding="utf-8")
+        self._written = os.path.getsize(self.path)
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        # path -> path.1 -> path.2 ..., dropping anything past the backup count
+        for i in range(self.backups - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def record(self, headers: Dict[str, str], body: str, arrived_at: Optional[float] = None) -> None:
+        """Write one request; never raises, capture must not break event handling."""
+        try:
+            content_type = headers.get("Content-Type") or headers.get("content-type") or ""
+            line = json.dumps(
+                {
+                    "t": arrived_at if arrived_at is not None else time.time(),
+                    "headers": redact_headers(headers),
+                    "body": redact_body(body, content_type),
+                },
+                ensure_ascii=False,
+            )
+            with self._lock:
+                if self._file is None:
+                    self._open()
+                self._file.write(line + "\n")
+                # Flush per record so a crash loses at most the current line
+                self._file.flush()
+                self._written = os.path.getsize(self.path)
+                self.records += 1
+                if self._written >= self.max_bytes:
+                    self._rotate()
+        except Exception as e:
+            print(f"Traffic capture failed: {e}")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,181 @@
+"""Compact in-memory storage for conversation turns.
+
+A thread's history is a ThreadHistory of Turn records instead of a list of
+(role, text) tuples. Turn is a two-slot record with an interned role, a little
+smaller than the tuple it replaces. It still unpacks like the old tuple
+(``role, text = turn``, ``turn[0]``), so callers did not need to change. The
+turn text dominates memory either way, so live threads cost about what they
+did before.
+
+The saving comes from packing. Threads idle for a while are packed into one
+compressed blob (zstd when the ``zstandard`` package is installed, zlib
+otherwise). Compressing the whole thread at once compresses far better than
+compressing each turn. Any access to turn contents unpacks it again
+transparently. ``len()`` and ``chars`` work without unpacking. Each history has
+its own lock, so packing one thread never blocks appends to another.
+"""
+import marshal
+import sys
+import threading
+import time
+import zlib
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+try:
+    import zstandard
+except Exception:
+    zstandard = None
+
+ROLES = (sys.intern("user"), sys.intern("model"))
+_ROLE_IDS = {role: i for i, role in enumerate(ROLES)}
+
+if zstandard is not None:
+    _compress = zstandard.ZstdCompressor(level=6).compress
+    _decompress = zstandard.ZstdDecompressor().decompress
+else:
+    _compress = lambda data: zlib.compress(data, 6)  # noqa: E731
+    _decompress = zlib.decompress
+
+
+class Turn:
+    """One conversation turn; unpacks as (role, text)."""
+
+    __slots__ = ("role", "text")
+
+    def __init__(self, role: str, text: str):
+        self.role = ROLES[_ROLE_IDS[role]] if role in _ROLE_IDS else sys.intern(role)
+        self.text = text
+
+    def __iter__(self):
+        yield self.role
+        yield self.text
+
+    def __getitem__(self, index: int):
+        if index == 0 or index == -2:
+            return self.role
+        if index == 1 or index == -1:
+            return self.text
+        raise IndexError("Turn index out of range")
+
+    def __len__(self) -> int:
+        return 2
+
+    def __eq__(self, other) -> bool:
+        try:
+            return tuple(self) == tuple(other)
+        except TypeError:
+            return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"Turn({self.role!r}, {self.text[:40]!r}{'...' if len(self.text) > 40 else ''})"
+
+
+TurnLike = Union[Turn, Tuple[str, str]]
+
+
+def _as_turn(item: TurnLike) -> Turn:
+    return item if isinstance(item, Turn) else Turn(item[0], item[1])
+
+
+class ThreadHistory:
+    """Turns of one thread, either as live Turn records or packed and compressed."""
+
+    __slots__ = ("_turns", "_packed", "_count", "_version", "chars", "last_access", "_lock")
+
+    def __init__(self, turns: Iterable[TurnLike] = ()):
+        self._turns: Optional[List[Turn]] = [_as_turn(t) for t in turns]
+        self._packed: Optional[bytes] = None
+        self._count = len(self._turns)
+        # Bumped on every append/pop, so pack() can tell if the thread changed while compressing
+        self._version = 0
+        self.chars = sum(len(t.text) for t in self._turns)
+        self.last_access = time.monotonic()
+        # Guards pack/unpack against concurrent appends to this thread
+        self._lock = threading.Lock()
+
+    @property
+    def is_packed(self) -> bool:
+        return self._packed is not None
+
+    def _unpack_locked(self) -> List[Turn]:
+        # Caller holds self._lock
+        if self._turns is None:
+            raw = marshal.loads(_decompress(self._packed))
+            self._turns = [Turn(ROLES[r] if isinstance(r, int) else r, text) for r, text in raw]
+            self._packed = None
+        return self._turns
+
+    def _live(self) -> List[Turn]:
+        """Return the live turn list, unpacking a compressed thread first."""
+        self.last_access = time.monotonic()
+        turns = self._turns
+        if turns is not None:
+            return turns
+        with self._lock:
+            return self._unpack_locked()
+
+    def pack(self) -> bool:
+        """Compress the thread into one blob; returns True if it was packed.
+
+        Compression runs outside the lock. If the thread changed meanwhile, it
+        stays live and the blob is discarded.
+        """
+        with self._lock:
+            if not self._turns:
+                return False
+            version = self._version
+            raw = [(_ROLE_IDS.get(t.role, t.role), t.text) for t in self._turns]
+        packed = _compress(marshal.dumps(raw))
+        with self._lock:
+            if self._version != version or self._turns is None:
+                return False
+            self._packed = packed
+            self._turns = None
+            return True
+
+    def append(self, item: TurnLike) -> None:
+        turn = _as_turn(item)
+        self.last_access = time.monotonic()
+        with self._lock:
+            self._unpack_locked().append(turn)
+            self._count += 1
+            self._version += 1
+            self.chars += len(turn.text)
+
+    def pop(self, index: int = -1) -> Turn:
+        self.last_access = time.monotonic()
+        with self._lock:
+            turn = self._unpack_locked().pop(index)
+            self._count -= 1
+            self._version += 1
+            self.chars -= len(turn.text)
+            return turn
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __bool__(self) -> bool:
+        return self._count > 0
+
+    def __iter__(self) -> Iterator[Turn]:
+        return iter(self._live())
+
+    def __reversed__(self) -> Iterator[Turn]:
+        return reversed(self._live())
+
+    def __getitem__(self, index):
+        return self._live()[index]
+
+    def __repr__(self) -> str:
+        state = "packed" if self.is_packed else "live"
+        return f"ThreadHistory({self._count} turns, {self.chars} chars, {state})"
+
+
+def pack_idle(histories: Sequence[ThreadHistory], idle_seconds: float) -> int:
+    """Compress every history not accessed for ``idle_seconds``; returns how many were packed."""
+    cutoff = time.monotonic() - idle_seconds
+    packed = 0
+    for history in list(histories):
+        if not history.is_packed and history.last_access < cutoff and history.pack():
+            packed += 1
+    return packed
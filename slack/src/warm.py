@@ -0,0 +1,147 @@
+"""Pre-generate answers for frequently asked questions.
+
+Questions come from a text file (one per line, ``#`` comments allowed) or a
+JSONL file of ``{"question": ..., "channel": ..., "team": ...}`` records, e.g.
+exported from logs. Each question goes through the same routing, profile and
+generation pipeline as a live first-turn mention (app.warm_answer), with
+bounded concurrency. Results land in the answer cache tagged with the corpus
+version, so warming needs ANSWER_CACHE_ENABLED and a corpus version
+(CORPUS_VERSION or the route's corpus_version).
+
+Warming runs either:
+  - at startup in the background, when WARM_QUESTIONS_FILE is set, or
+  - from the CLI. By default the CLI warms an in-process instance, which is
+    useful for checking a question list and timing it. With --url it triggers
+    warming on a running instance through POST /admin/warm, which is only
+    served when that instance sets WARM_ADMIN_TOKEN.
+
+Usage:
+    python warm.py questions.txt --concurrency 4
+    python warm.py questions.jsonl --url https://bot.example.com --token "$WARM_ADMIN_TOKEN"
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+from urllib import request as urlrequest
+
+
+def load_questions(path: str) -> List[dict]:
+    """Read questions from a .txt (one per line) or .jsonl file, dropping duplicates."""
+    questions: List[dict] = []
+    seen = set()
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if path.endswith(".jsonl") or line.startswith("{"):
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    continue
+            else:
+                item = {"question": line}
+            question = (item.get("question") or "").strip()
+            key = (question.lower(), item.get("channel"), item.get("team"))
+            if question and key not in seen:
+                seen.add(key)
+                questions.append(item)
+    return questions
+
+
+class WarmJob:
+    """Runs warm_fn over a question list with bounded concurrency and tracks progress."""
+
+    def __init__(self, questions: List[dict], warm_fn: Callable[..., str], concurrency: int = 4):
+        self.questions = questions
+        self._warm_fn = warm_fn
+        self.concurrency = max(1, concurrency)
+        self.progress: Dict[str, object] = {
+            "total": len(questions), "done": 0, "warmed": 0, "skipped": 0, "failed": 0,
+            "running": False, "started_at": None, "elapsed_s": 0.0,
+        }
+        self._lock = threading.Lock()
+
+    def _one(self, item: dict) -> None:
+        try:
+            outcome = self._warm_fn(item["question"], channel=item.get("channel"), team=item.get("team"))
+        except Exception as e:
+            print(f"Warming failed for {item['question'][:60]!r}: {e}")
+            outcome = "failed"
+        with self._lock:
+            self.progress["done"] += 1
+            self.progress[outcome if outcome in ("warmed", "skipped") else "failed"] += 1
+            done, total = self.progress["done"], self.progress["total"]
+        if done == total or done % 10 == 0:
+            print(f"Warm-up progress: {done}/{total}")
+
+    def run(self) -> dict:
+        started = time.time()
+        with self._lock:
+            self.progress["running"] = True
+            self.progress["started_at"] = started
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="warm") as pool:
+            list(pool.map(self._one, self.questions))
+        with self._lock:
+            self.progress["running"] = False
+            self.progress["elapsed_s"] = round(time.time() - started, 3)
+            return dict(self.progress)
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.run, name="warm-job", daemon=True)
+        thread.start()
+        return thread
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            progress = dict(self.progress)
+        if progress["running"] and progress["started_at"]:
+            progress["elapsed_s"] = round(time.time() - progress["started_at"], 3)
+        return progress
+
+
+def _trigger_remote(url: str, token: str, questions: List[dict], concurrency: int) -> dict:
+    body = json.dumps({"questions": questions, "concurrency": concurrency}).encode("utf-8")
+    req = urlrequest.Request(
+        url.rstrip("/") + "/admin/warm",
+        data=body,
+        headers={"Content-Type": "application/json", "Authorization": f"Bearer {token}"},
+        method="POST",
+    )
+    with urlrequest.urlopen(req, timeout=30) as resp:
+        return json.loads(resp.read().decode("utf-8"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-generate answers for frequent questions")
+    parser.add_argument("path", help="questions file (.txt, one per line, or .jsonl)")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("WARM_CONCURRENCY", "4")))
+    parser.add_argument("--url", help="base URL of a running bot; warms that instance via POST /admin/warm")
+    parser.add_argument("--token", default=os.getenv("WARM_ADMIN_TOKEN"), help="WARM_ADMIN_TOKEN of the instance, for --url")
+    args = parser.parse_args()
+
+    questions = load_questions(args.path)
+    if not questions:
+        raise SystemExit("No questions found")
+
+    if args.url:
+        if not args.token:
+            raise SystemExit("--token (or WARM_ADMIN_TOKEN) is required with --url")
+        print(json.dumps(_trigger_remote(args.url, args.token, questions, args.concurrency), indent=2))
+        return
+
+    import app
+
+    job = WarmJob(questions, app.warm_answer, args.concurrency)
+    result = job.run()
+    if app._answer_cache is not None:
+        result["answer_cache"] = app._answer_cache.snapshot()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()